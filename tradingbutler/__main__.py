@@ -0,0 +1,5 @@
+import sys
+
+from tradingbutler.cli import main
+
+sys.exit(main())
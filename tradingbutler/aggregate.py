@@ -0,0 +1,119 @@
+from decimal import ROUND_HALF_UP
+from decimal import Decimal
+
+from tradingbutler.instrumentation import instrumented
+from tradingbutler.records import Aggregate
+
+AGGREGATE_KEYS = ['key', 'positions', 'open', 'closed', 'wins', 'losses', 'win_rate', 'total_profit', 'expectancy',
+                  'average_win', 'average_loss', 'average_days', 'total_risk']
+# Flat exports carry every grouping in one table
+EXPORT_KEYS = ['grouping'] + AGGREGATE_KEYS
+
+
+def _get_month(position_summary):
+    exit_date = position_summary['exit_date']
+    return None if exit_date is None else '{:04d}-{:02d}'.format(exit_date.year, exit_date.month)
+
+
+# Period groupings use the exit date, so open positions only count towards symbol and direction
+GROUPINGS = {
+    'all': lambda position_summary: 'All',
+    'symbol': lambda position_summary: position_summary['symbol'],
+    'direction': lambda position_summary: position_summary['direction'],
+    'month': _get_month,
+    'day': lambda position_summary: position_summary['exit_date'],
+}
+
+
+class _Accumulator:
+    __slots__ = ('positions', 'open', 'wins', 'losses', 'closed', 'total_profit', 'win_profit', 'loss_profit', 'days',
+                 'total_risk')
+
+    def __init__(self):
+        self.positions = 0
+        self.open = 0
+        self.closed = 0
+        self.wins = 0
+        self.losses = 0
+        self.total_profit = Decimal(0)
+        self.win_profit = Decimal(0)
+        self.loss_profit = Decimal(0)
+        self.days = 0
+        self.total_risk = Decimal(0)
+
+    def add(self, position_summary):
+        self.positions += 1
+        self.total_risk += position_summary['risk']
+        # Marked open positions carry an unrealized profit, only a closing counts towards the results
+        if position_summary['exit_date'] is None:
+            self.open += 1
+            return
+        profit = position_summary['profit']
+        self.closed += 1
+        self.days += position_summary['days']
+        self.total_profit += profit
+        if profit > 0:
+            self.wins += 1
+            self.win_profit += profit
+        elif profit < 0:
+            self.losses += 1
+            self.loss_profit += profit
+
+    def get_aggregate(self, grouping, key):
+        return Aggregate(
+            grouping=grouping,
+            key=key,
+            positions=self.positions,
+            open=self.open,
+            closed=self.closed,
+            wins=self.wins,
+            losses=self.losses,
+            win_rate=_divide(self.wins * 100, self.closed, Decimal('0.01')),
+            total_profit=self.total_profit.quantize(Decimal('0.0001'), ROUND_HALF_UP),
+            expectancy=_divide(self.total_profit, self.closed, Decimal('0.0001')),
+            average_win=_divide(self.win_profit, self.wins, Decimal('0.0001')),
+            average_loss=_divide(self.loss_profit, self.losses, Decimal('0.0001')),
+            average_days=_divide(self.days, self.closed, Decimal('0.01')),
+            total_risk=self.total_risk.quantize(Decimal('0.0001'), ROUND_HALF_UP)
+        )
+
+
+def _divide(numerator, denominator, exponent):
+    if not denominator:
+        return None
+    return (Decimal(numerator) / denominator).quantize(exponent, ROUND_HALF_UP)
+
+
+@instrumented('get_aggregates')
+def get_aggregates(position_summaries, groupings=('all', 'symbol', 'direction', 'month', 'day')):
+    key_functions = [(grouping, GROUPINGS[grouping]) for grouping in groupings]
+    accumulators = {grouping: {} for grouping in groupings}
+    for position_summary in position_summaries:
+        for grouping, get_key in key_functions:
+            key = get_key(position_summary)
+            if key is None:
+                continue
+            accumulator = accumulators[grouping].get(key)
+            if accumulator is None:
+                accumulator = accumulators[grouping][key] = _Accumulator()
+            accumulator.add(position_summary)
+    return {
+        grouping: [accumulator.get_aggregate(grouping, key)
+                   for key, accumulator in sorted(accumulators[grouping].items())]
+        for grouping in groupings
+    }
+
+
+@instrumented('write_aggregates')
+def write_aggregates(aggregates, keys=None, template_file='aggregates.html', output_file='aggregates.html',
+                     buffer_size=100):
+    from tradingbutler.summary import render_template
+
+    if keys is None:
+        keys = AGGREGATE_KEYS
+    render_template(template_file, output_file, buffer_size, aggregates=aggregates, keys=keys)
+
+
+def iter_aggregate_rows(aggregates):
+    for rows in aggregates.values():
+        yield from rows
@@ -0,0 +1,115 @@
+import argparse
+import datetime
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from tradingbutler.summary import TdaTradeImporter
+from tradingbutler.summary import get_position_summaries
+from tradingbutler.summary import get_positions
+from tradingbutler.summary import write_output
+from tradingbutler.synthetic import write_orders
+
+STAGES = ('import', 'get_positions', 'get_position_summaries', 'write_output')
+
+
+def measure(export_path, output_path, current_date, trace_memory):
+    results = {}
+
+    def run(stage, function, *args):
+        gc.collect()
+        if trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        value = function(*args)
+        elapsed = time.perf_counter() - start
+        if trace_memory:
+            results[stage] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        else:
+            results[stage] = elapsed
+        return value
+
+    legs = run('import', lambda: TdaTradeImporter.from_path(export_path).legs)
+    positions = run('get_positions', get_positions, legs)
+    position_summaries = run('get_position_summaries', get_position_summaries, positions, current_date)
+    run('write_output', write_output, position_summaries, None, 'template.html', output_path)
+    return results
+
+
+def run_benchmark(orders=10000, symbols=50, fills_per_order=(1, 3), shares=(1, 500), short_ratio=0.3, seed=0,
+                  trace_memory=True, directory=None):
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        export_path = os.path.join(tmp, 'orders.json')
+        output_path = os.path.join(tmp, 'output.html')
+        write_orders(export_path, orders=orders, symbols=symbols, fills_per_order=fills_per_order, shares=shares,
+                     short_ratio=short_ratio, seed=seed)
+        current_date = datetime.date(2030, 1, 1)
+        # Timings and memory peaks come from separate runs because tracemalloc slows allocation-heavy code
+        seconds = measure(export_path, output_path, current_date, trace_memory=False)
+        peaks = measure(export_path, output_path, current_date, trace_memory=True) if trace_memory else {}
+        executions = len(TdaTradeImporter.from_path(export_path).legs)
+        return {
+            'orders': orders,
+            'executions': executions,
+            'export_bytes': os.path.getsize(export_path),
+            'stages': {stage: {'seconds': seconds[stage], 'peak_bytes': peaks.get(stage)} for stage in STAGES},
+        }
+
+
+def find_regressions(result, baseline, tolerance):
+    regressions = []
+    for stage in STAGES:
+        current = result['stages'][stage]['seconds']
+        previous = baseline['stages'][stage]['seconds']
+        if current > previous * (1 + tolerance):
+            regressions.append('{}: {:.3f}s vs {:.3f}s baseline'.format(stage, current, previous))
+    return regressions
+
+
+def format_result(result):
+    lines = ['{orders} orders, {executions} executions, {export_bytes} bytes'.format(**result)]
+    for stage in STAGES:
+        stats = result['stages'][stage]
+        peak = '' if stats['peak_bytes'] is None else '  peak {:10.1f} KiB'.format(stats['peak_bytes'] / 1024)
+        lines.append('{:<24}{:9.3f} s{}'.format(stage, stats['seconds'], peak))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m tradingbutler.bench', description='Benchmark the pipeline.')
+    parser.add_argument('--orders', type=int, default=10000)
+    parser.add_argument('--symbols', type=int, default=50)
+    parser.add_argument('--fills', type=int, nargs=2, default=(1, 3), metavar=('MIN', 'MAX'))
+    parser.add_argument('--shares', type=int, nargs=2, default=(1, 500), metavar=('MIN', 'MAX'))
+    parser.add_argument('--short-ratio', type=float, default=0.3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc run')
+    parser.add_argument('--save', help='write results as JSON')
+    parser.add_argument('--compare', help='fail if a stage is slower than this saved JSON result')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    result = run_benchmark(orders=args.orders, symbols=args.symbols, fills_per_order=tuple(args.fills),
+                           shares=tuple(args.shares), short_ratio=args.short_ratio, seed=args.seed,
+                           trace_memory=not args.no_memory)
+    print(format_result(result))
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = find_regressions(result, json.load(f), args.tolerance)
+        for regression in regressions:
+            print('regression: ' + regression, file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,70 @@
+import hashlib
+import os
+import pickle
+import tempfile
+
+from tradingbutler.records import Leg
+
+CACHE_VERSION = 3
+
+
+def get_file_digest(path, chunk_size=1 << 20):
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class LegCache:
+    def __init__(self, directory):
+        self.directory = directory
+
+    def get_entry_path(self, path, namespace=''):
+        key = '{}\0{}'.format(namespace, os.path.abspath(path))
+        return os.path.join(self.directory, hashlib.blake2b(key.encode('utf-8'), digest_size=16).hexdigest() + '.legs')
+
+    def load(self, path, namespace=''):
+        entry_path = self.get_entry_path(path, namespace)
+        try:
+            with open(entry_path, 'rb') as f:
+                header = pickle.load(f)
+                if header.get('version') != CACHE_VERSION or header.get('path') != os.path.abspath(path):
+                    return None
+                stat = os.stat(path)
+                if (header['size'], header['mtime_ns']) != (stat.st_size, stat.st_mtime_ns):
+                    # Touched but possibly unchanged, fall back to comparing content
+                    if header['size'] != stat.st_size or header['digest'] != get_file_digest(path):
+                        return None
+                    header.update(mtime_ns=stat.st_mtime_ns)
+                    rows = pickle.load(f)
+                    self._write(entry_path, header, rows)
+                else:
+                    rows = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        return [Leg(*row) for row in rows]
+
+    def store(self, path, legs, namespace=''):
+        stat = os.stat(path)
+        header = {
+            'version': CACHE_VERSION,
+            'path': os.path.abspath(path),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'digest': get_file_digest(path),
+        }
+        rows = [tuple(leg.get(key) for key in Leg.fields) for leg in legs]
+        self._write(self.get_entry_path(path, namespace), header, rows)
+
+    def _write(self, entry_path, header, rows):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(header, f, pickle.HIGHEST_PROTOCOL)
+                pickle.dump(rows, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, entry_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
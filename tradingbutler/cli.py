@@ -0,0 +1,109 @@
+import argparse
+import glob
+import sys
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog='tradingbutler', description='Turn TDA order-history exports into a report.')
+    parser.add_argument('paths', nargs='*', help='export files or glob patterns')
+    parser.add_argument('-o', '--output', default='output.html', help='report file to write')
+    parser.add_argument('--format', choices=['html', 'csv', 'jsonl'],
+                        help='report format, by default taken from the output file extension')
+    parser.add_argument('--descending', action='store_true', help='exports list orders oldest first')
+    parser.add_argument('--processes', type=int, help='worker processes used to import exports')
+    parser.add_argument('--match-processes', type=int, default=1,
+                        help='worker processes used to match positions, sharded by symbol')
+    parser.add_argument('--relief', choices=['fifo', 'lifo', 'hifo', 'average'], default='fifo',
+                        help='which open lots a closing relieves: first in, last in, highest cost or at average cost')
+    parser.add_argument('--cache-dir', help='directory for cached parsed legs')
+    parser.add_argument('--marks', help='price snapshot (JSON or CSV) to value open positions at')
+    parser.add_argument('--store', help='SQLite trade store to ingest into and report from')
+    parser.add_argument('--backend', choices=['python', 'numpy'], default='python', help='summary backend')
+    parser.add_argument('--scaled', action='store_true',
+                        help='match and total prices as integers in 1e-4 units, prices may have 4 decimals at most')
+    parser.add_argument('--precompile', action='store_true', help='compile templates to the bytecode cache')
+    parser.add_argument('--watch', metavar='DIRECTORY', help='poll a directory of exports and keep the report current')
+    parser.add_argument('--interval', type=float, default=1.0, help='seconds between polls with --watch')
+    parser.add_argument('--stats', help='append per-stage timings as JSON lines to this file')
+    parser.add_argument('--trace-memory', action='store_true', help='record tracemalloc peaks with --stats')
+    return parser
+
+
+def main(argv=None):
+    parser = get_parser()
+    args = parser.parse_args(argv)
+    if not args.paths and not args.precompile and not args.watch:
+        parser.error('no export paths given')
+    if args.scaled and (args.store or args.marks or args.backend != 'python'):
+        parser.error('--scaled cannot be combined with --store, --marks or --backend')
+    if args.scaled and args.relief == 'average':
+        parser.error('--scaled cannot be combined with --relief average')
+
+    if args.precompile:
+        from tradingbutler.summary import precompile_templates
+
+        precompile_templates()
+    if args.watch:
+        from tradingbutler.watch import ReportWatcher
+
+        watcher = ReportWatcher(args.watch, output_file=args.output, descending=args.descending,
+                                cache_dir=args.cache_dir, relief=args.relief)
+        try:
+            watcher.run(args.interval)
+        except KeyboardInterrupt:
+            pass
+        return 0
+    if not args.paths:
+        return 0
+    paths = []
+    for pattern in args.paths:
+        matches = sorted(glob.glob(pattern))
+        if not matches:
+            parser.error('no export matches {}'.format(pattern))
+        paths.extend(matches)
+    if args.stats is None:
+        run_report(args, paths)
+    else:
+        from tradingbutler.instrumentation import PipelineStats
+
+        with open(args.stats, 'a') as f, PipelineStats(trace_memory=args.trace_memory, output=f):
+            run_report(args, paths)
+    return 0
+
+
+def run_report(args, paths):
+    # Imported here so that --help and argument errors return without loading the pipeline
+    from tradingbutler.export import WRITERS
+    from tradingbutler.export import get_format
+    from tradingbutler.summary import get_position_summaries
+    from tradingbutler.summary import get_positions
+    from tradingbutler.summary import import_paths
+    from tradingbutler.summary import write_output
+
+    legs = import_paths(paths, processes=args.processes, descending=args.descending, cache_dir=args.cache_dir,
+                        scaled=args.scaled)
+    backend = 'scaled' if args.scaled else args.backend
+    if args.store is None:
+        positions = get_positions(legs, processes=args.match_processes, scaled=args.scaled, relief=args.relief)
+    else:
+        from tradingbutler.store import TradeStore
+
+        with TradeStore(args.store, relief=args.relief) as store:
+            store.ingest(legs)
+            positions = store.get_positions()
+    if args.marks is None:
+        position_summaries = get_position_summaries(positions, backend=backend)
+    else:
+        from tradingbutler.marks import PriceSnapshot
+        from tradingbutler.marks import iter_marked_summaries
+
+        position_summaries = list(iter_marked_summaries(positions, PriceSnapshot.from_path(args.marks)))
+    output_format = args.format or get_format(args.output)
+    if output_format == 'html':
+        write_output(position_summaries, output_file=args.output)
+    else:
+        WRITERS[output_format](position_summaries, output_file=args.output)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
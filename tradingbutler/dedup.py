@@ -0,0 +1,92 @@
+MAX_MEMORY_KEYS = 1000000
+FILTER_BITS_PER_KEY = 16
+
+
+def get_leg_key(leg):
+    activity_id = leg.get('activity_id')
+    execution_index = leg.get('execution_index')
+    return (leg['order_id'], -1 if activity_id is None else activity_id,
+            -1 if execution_index is None else execution_index)
+
+
+class SeenKeys:
+    def __init__(self, max_memory_keys=MAX_MEMORY_KEYS):
+        self.max_memory_keys = max_memory_keys
+        self._memory = set()
+        self._connection = None
+        self._filter = None
+        self._filter_bits = 0
+        self._spilled = 0
+
+    def __len__(self):
+        spilled = self._connection.execute('SELECT COUNT(*) FROM seen').fetchone()[0] if self._connection else 0
+        return len(self._memory) + spilled
+
+    def __contains__(self, key):
+        if key in self._memory:
+            return True
+        if self._connection is None or not self._might_be_spilled(key):
+            return False
+        return self._connection.execute('SELECT 1 FROM seen WHERE order_id = ? AND activity_id = ? AND '
+                                        'execution_index = ?', key).fetchone() is not None
+
+    def add(self, key):
+        if key in self:
+            return False
+        self._memory.add(key)
+        if len(self._memory) >= self.max_memory_keys:
+            self._spill()
+        return True
+
+    def _get_bits(self, key):
+        value = hash(key)
+        return value % self._filter_bits, (value // self._filter_bits) % self._filter_bits
+
+    def _might_be_spilled(self, key):
+        # New keys almost never hit the disk, only the filter's false positives and real duplicates do
+        for bit in self._get_bits(key):
+            if not self._filter[bit >> 3] & (1 << (bit & 7)):
+                return False
+        return True
+
+    def _spill(self):
+        if self._connection is None:
+            import sqlite3
+
+            # An empty path gives a private temporary database that sqlite deletes on close
+            self._connection = sqlite3.connect('')
+            self._connection.execute('CREATE TABLE seen (order_id INTEGER, activity_id INTEGER, '
+                                     'execution_index INTEGER, PRIMARY KEY (order_id, activity_id, execution_index)) '
+                                     'WITHOUT ROWID')
+        with self._connection:
+            self._connection.executemany('INSERT OR IGNORE INTO seen VALUES (?, ?, ?)', sorted(self._memory))
+        self._spilled += len(self._memory)
+        if self._spilled * FILTER_BITS_PER_KEY > self._filter_bits:
+            # The filter at least doubles whenever the disk outgrows it, so its false positive rate stays where it
+            # started and every spilled key is rehashed O(1) times amortized
+            self._filter_bits = max(2 * self._filter_bits, self._spilled * FILTER_BITS_PER_KEY)
+            self._filter = bytearray(self._filter_bits // 8 + 1)
+            self._set_bits(self._connection.execute('SELECT order_id, activity_id, execution_index FROM seen'))
+        else:
+            self._set_bits(self._memory)
+        self._memory = set()
+
+    def _set_bits(self, keys):
+        for key in keys:
+            for bit in self._get_bits(key):
+                self._filter[bit >> 3] |= 1 << (bit & 7)
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+def iter_unique_legs(legs, max_memory_keys=MAX_MEMORY_KEYS):
+    seen = SeenKeys(max_memory_keys)
+    try:
+        for leg in legs:
+            if seen.add(get_leg_key(leg)):
+                yield leg
+    finally:
+        seen.close()
@@ -0,0 +1,77 @@
+import csv
+import datetime
+import json
+from decimal import Decimal
+
+from tradingbutler.instrumentation import instrumented
+from tradingbutler.summary import DEFAULT_KEYS
+
+BUFFER_SIZE = 1 << 16
+
+
+def _open(output_file, buffer_size):
+    if hasattr(output_file, 'write'):
+        return output_file, False
+    return open(output_file, 'w', buffering=buffer_size, newline='', encoding='utf-8'), True
+
+
+def _get_csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, (list, tuple)):
+        return ' '.join(map(str, value))
+    return value
+
+
+def _get_json_value(value):
+    # Decimals are written as JSON numbers with their exact digits rather than through float
+    if value is None:
+        return 'null'
+    if isinstance(value, (int, Decimal)) and not isinstance(value, bool):
+        return str(value)
+    if isinstance(value, datetime.date):
+        return '"{}"'.format(value.isoformat())
+    return json.dumps(value, separators=(',', ':'))
+
+
+@instrumented('write_csv')
+def write_csv(rows, output_file='output.csv', keys=None, buffer_size=BUFFER_SIZE):
+    if keys is None:
+        keys = DEFAULT_KEYS
+    f, close = _open(output_file, buffer_size)
+    try:
+        writer = csv.writer(f)
+        writer.writerow(keys)
+        for row in rows:
+            writer.writerow([_get_csv_value(row.get(key)) for key in keys])
+    finally:
+        if close:
+            f.close()
+
+
+@instrumented('write_jsonl')
+def write_jsonl(rows, output_file='output.jsonl', keys=None, buffer_size=BUFFER_SIZE):
+    if keys is None:
+        keys = DEFAULT_KEYS
+    prefixes = ['{}:'.format(json.dumps(key)) for key in keys]
+    f, close = _open(output_file, buffer_size)
+    try:
+        for row in rows:
+            f.write('{' + ','.join([prefix + _get_json_value(row.get(key)) for prefix, key in zip(prefixes, keys)])
+                    + '}\n')
+    finally:
+        if close:
+            f.close()
+
+
+WRITERS = {
+    'csv': write_csv,
+    'jsonl': write_jsonl,
+}
+
+
+def get_format(output_file):
+    for name in WRITERS:
+        if str(output_file).endswith('.' + name):
+            return name
+    return 'html'
@@ -0,0 +1,127 @@
+from bisect import bisect_left
+from bisect import bisect_right
+from itertools import product
+from operator import itemgetter
+
+DIRECTIONS = ('Long', 'Short')
+STATUSES = ('open', 'closed')
+# Pending entries up to this many are inserted one by one, more are merged in a single pass
+INSERT_LIMIT = 16
+
+
+def _get_fields(item):
+    # Accepts positions from get_positions as well as summaries from get_position_summaries
+    if 'opening' in item:
+        opening = item['opening']
+        closing = item.get('closing')
+        direction = 'Long' if opening['instruction'] == 'BUY' else 'Short'
+        exit_date = closing['time'].date() if closing is not None else None
+        return opening['symbol'], direction, opening['time'].date(), exit_date
+    return item['symbol'], item['direction'], item['entry_date'], item['exit_date']
+
+
+class _DateIndex:
+    __slots__ = ('dates', 'ids', 'pending')
+
+    def __init__(self):
+        self.dates = []
+        self.ids = []
+        self.pending = []
+
+    def add(self, date, position_id):
+        self.pending.append((date, position_id))
+
+    def _merge_pending(self):
+        # Ids only grow, so sorting on the date alone keeps ties in id order, and an added entry always goes after the
+        # indexed ones with the same date
+        pending = sorted(self.pending, key=itemgetter(0))
+        self.pending = []
+        dates = self.dates
+        ids = self.ids
+        if not dates or pending[0][0] >= dates[-1]:
+            dates.extend(date for date, _ in pending)
+            ids.extend(position_id for _, position_id in pending)
+            return
+        if len(pending) <= INSERT_LIMIT:
+            # A few entries are cheaper to insert in place than to copy every indexed one for
+            for date, position_id in pending:
+                position = bisect_right(dates, date)
+                dates.insert(position, date)
+                ids.insert(position, position_id)
+            return
+        merged_dates = []
+        merged_ids = []
+        low = 0
+        for date, position_id in pending:
+            high = bisect_right(dates, date, low)
+            merged_dates += dates[low:high]
+            merged_ids += ids[low:high]
+            merged_dates.append(date)
+            merged_ids.append(position_id)
+            low = high
+        merged_dates += dates[low:]
+        merged_ids += ids[low:]
+        self.dates = merged_dates
+        self.ids = merged_ids
+
+    def get_range(self, start, end):
+        if self.pending:
+            # Appends are merged in on the next query, keeping bulk loads O(n log n)
+            self._merge_pending()
+        low = 0 if start is None else bisect_left(self.dates, start)
+        high = len(self.dates) if end is None else bisect_right(self.dates, end)
+        return self.ids[low:high]
+
+
+class PositionIndex:
+    def __init__(self, positions=()):
+        self.positions = []
+        self._entry_indexes = {}
+        self._exit_indexes = {}
+        self.add_positions(positions)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def add_position(self, position):
+        symbol, direction, entry_date, exit_date = _get_fields(position)
+        position_id = len(self.positions)
+        self.positions.append(position)
+        status = 'open' if exit_date is None else 'closed'
+        # Every combination of filters gets its own sorted index, so a query never scans unrelated positions
+        for key in product((symbol, None), (direction, None), (status, None)):
+            self._get_index(self._entry_indexes, key).add(entry_date, position_id)
+        if exit_date is not None:
+            for key in product((symbol, None), (direction, None)):
+                self._get_index(self._exit_indexes, key).add(exit_date, position_id)
+
+    def add_positions(self, positions):
+        for position in positions:
+            self.add_position(position)
+
+    @staticmethod
+    def _get_index(indexes, key):
+        index = indexes.get(key)
+        if index is None:
+            index = indexes[key] = _DateIndex()
+        return index
+
+    @property
+    def symbols(self):
+        return sorted(symbol for symbol, direction, status in self._entry_indexes
+                      if symbol is not None and direction is None and status is None)
+
+    def query(self, symbol=None, direction=None, status=None, start=None, end=None, date='entry'):
+        if direction is not None and direction not in DIRECTIONS:
+            raise ValueError('direction must be one of {}'.format(DIRECTIONS))
+        if status is not None and status not in STATUSES:
+            raise ValueError('status must be one of {}'.format(STATUSES))
+        if date == 'entry':
+            index = self._entry_indexes.get((symbol, direction, status))
+        elif date == 'exit':
+            index = None if status == 'open' else self._exit_indexes.get((symbol, direction))
+        else:
+            raise ValueError("date must be 'entry' or 'exit'")
+        if index is None:
+            return []
+        return [self.positions[position_id] for position_id in index.get_range(start, end)]
@@ -0,0 +1,112 @@
+import json
+import time
+import tracemalloc
+from functools import wraps
+
+_active = None
+
+
+class StageStats:
+    __slots__ = ('name', 'calls', 'seconds', 'rows', 'peak_bytes')
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.rows = 0
+        self.peak_bytes = None
+
+    def as_dict(self):
+        return {
+            'stage': self.name,
+            'calls': self.calls,
+            'seconds': self.seconds,
+            'rows': self.rows,
+            'peak_bytes': self.peak_bytes,
+        }
+
+
+class PipelineStats:
+    def __init__(self, trace_memory=False, output=None):
+        self.trace_memory = trace_memory
+        self.output = output
+        self.stages = {}
+        self._previous = None
+
+    def __enter__(self):
+        global _active
+        self._previous = _active
+        _active = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _active
+        _active = self._previous
+        self._previous = None
+
+    def __getitem__(self, name):
+        return self.stages[name]
+
+    def run(self, name, function, args, kwargs):
+        started_tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        elif self.trace_memory and hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0] if self.trace_memory else 0
+        start = time.perf_counter()
+        try:
+            result = function(*args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - start
+            peak_bytes = tracemalloc.get_traced_memory()[1] - baseline if self.trace_memory else None
+            if started_tracing:
+                tracemalloc.stop()
+        rows = _count_rows(result if result is not None else (args[0] if args else None))
+        self.record(name, seconds, rows, peak_bytes)
+        return result
+
+    def record(self, name, seconds, rows=None, peak_bytes=None):
+        stats = self.stages.get(name)
+        if stats is None:
+            stats = self.stages[name] = StageStats(name)
+        stats.calls += 1
+        stats.seconds += seconds
+        stats.rows += rows or 0
+        if peak_bytes is not None:
+            stats.peak_bytes = max(stats.peak_bytes or 0, peak_bytes)
+        if self.output is not None:
+            self.output.write(json.dumps({'stage': name, 'seconds': seconds, 'rows': rows,
+                                          'peak_bytes': peak_bytes}) + '\n')
+
+    def as_dict(self):
+        return {name: stats.as_dict() for name, stats in self.stages.items()}
+
+
+def _count_rows(value):
+    if isinstance(value, (list, tuple)):
+        return len(value)
+    return None
+
+
+def get_active_stats():
+    return _active
+
+
+def run_stage(name, function, *args, **kwargs):
+    stats = _active
+    if stats is None:
+        return function(*args, **kwargs)
+    return stats.run(name, function, args, kwargs)
+
+
+def instrumented(name):
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            stats = _active
+            if stats is None:
+                return function(*args, **kwargs)
+            return stats.run(name, function, args, kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,196 @@
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from decimal import Decimal
+
+from tradingbutler.records import Leg
+from tradingbutler.times import decode_time
+from tradingbutler.times import encode_time
+
+MAGIC = b'TBLEGS01'
+ALIGNMENT = 8
+NULL_ID = -2 ** 63
+# Legs decoded per step when iterating, so only a bounded slice of the columns is ever held as Python objects
+ITER_CHUNK = 4096
+
+COLUMNS = (
+    ('quantity', 'q'),
+    ('price_mantissa', 'q'),
+    ('price_exponent', 'b'),
+    ('time', 'q'),
+    ('utc_offset', 'i'),
+    ('symbol', 'I'),
+    ('instruction', 'H'),
+    ('order_id', 'q'),
+    ('activity_id', 'q'),
+    ('execution_index', 'q'),
+)
+
+
+def _get_price(value):
+    if not isinstance(value, Decimal):
+        value = Decimal(value)
+    exponent = value.as_tuple().exponent
+    if not isinstance(exponent, int):
+        raise ValueError('cannot store price {}'.format(value))
+    return int(value.scaleb(-exponent)), exponent
+
+
+def write_legs(path, legs):
+    symbols = {}
+    instructions = {}
+    columns = {name: array(code) for name, code in COLUMNS}
+    for leg in legs:
+        mantissa, exponent = _get_price(leg['price'])
+        time, offset = encode_time(leg['time'])
+        activity_id = leg.get('activity_id')
+        execution_index = leg.get('execution_index')
+        columns['quantity'].append(leg['quantity'])
+        columns['price_mantissa'].append(mantissa)
+        columns['price_exponent'].append(exponent)
+        columns['time'].append(time)
+        columns['utc_offset'].append(offset)
+        columns['symbol'].append(symbols.setdefault(leg['symbol'], len(symbols)))
+        columns['instruction'].append(instructions.setdefault(leg['instruction'], len(instructions)))
+        columns['order_id'].append(leg['order_id'])
+        columns['activity_id'].append(NULL_ID if activity_id is None else activity_id)
+        columns['execution_index'].append(NULL_ID if execution_index is None else execution_index)
+
+    header = {
+        'byteorder': sys.byteorder,
+        'count': len(columns['quantity']),
+        'symbols': list(symbols),
+        'instructions': list(instructions),
+        'columns': [],
+    }
+    # Column offsets are relative to the data section, which starts at the first aligned byte after the header
+    offset = 0
+    for name, code in COLUMNS:
+        header['columns'].append([name, code, offset])
+        offset += len(columns[name]) * columns[name].itemsize
+        offset += -offset % ALIGNMENT
+    encoded = json.dumps(header).encode('utf-8')
+    encoded += b' ' * (-(len(MAGIC) + 4 + len(encoded)) % ALIGNMENT)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(MAGIC)
+            f.write(struct.pack('<I', len(encoded)))
+            f.write(encoded)
+            for name, code in COLUMNS:
+                column = columns[name]
+                column.tofile(f)
+                f.write(b'\0' * (-(len(column) * column.itemsize) % ALIGNMENT))
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class LegFile:
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            self._mmap.close()
+            raise ValueError('{} is not a leg file'.format(path))
+        header_length, = struct.unpack_from('<I', self._mmap, len(MAGIC))
+        start = len(MAGIC) + 4
+        header = json.loads(bytes(self._mmap[start:start + header_length]))
+        data_offset = start + header_length
+        if header['byteorder'] != sys.byteorder:
+            self._mmap.close()
+            raise ValueError('{} was written on a {} endian machine'.format(path, header['byteorder']))
+        self.count = header['count']
+        self.symbols = header['symbols']
+        self.instructions = header['instructions']
+        # Columns are views straight into the mapping, pages are loaded on access and shared between processes
+        buffer = memoryview(self._mmap)
+        self.columns = {}
+        for name, code, offset in header['columns']:
+            size = struct.calcsize(code)
+            offset += data_offset
+            self.columns[name] = buffer[offset:offset + self.count * size].cast(code)
+
+    def __reduce__(self):
+        return type(self), (self.path,)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(self.count)
+            if step == 1:
+                return self.get_legs(start, stop)
+            return [self.get_leg(j) for j in range(start, stop, step)]
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError('leg index out of range')
+        return self.get_leg(i)
+
+    def __iter__(self):
+        for start in range(0, self.count, ITER_CHUNK):
+            yield from self.get_legs(start, min(start + ITER_CHUNK, self.count))
+
+    def close(self):
+        for column in self.columns.values():
+            column.release()
+        self.columns = {}
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get_price(self, i):
+        return Decimal(self.columns['price_mantissa'][i]).scaleb(self.columns['price_exponent'][i])
+
+    def get_time(self, i):
+        return decode_time(self.columns['time'][i], self.columns['utc_offset'][i])
+
+    def get_leg(self, i):
+        activity_id = self.columns['activity_id'][i]
+        leg = Leg(
+            quantity=self.columns['quantity'][i],
+            price=self.get_price(i),
+            time=self.get_time(i),
+            instruction=self.instructions[self.columns['instruction'][i]],
+            symbol=self.symbols[self.columns['symbol'][i]],
+            order_id=self.columns['order_id'][i],
+            activity_id=None if activity_id == NULL_ID else activity_id
+        )
+        execution_index = self.columns['execution_index'][i]
+        if execution_index != NULL_ID:
+            leg.execution_index = execution_index
+        return leg
+
+    def get_legs(self, start, stop):
+        # Whole column slices are converted at once, indexing the views leg by leg costs a lookup per field
+        rows = zip(*[self.columns[name][start:stop].tolist() for name, _ in COLUMNS])
+        legs = []
+        for (quantity, mantissa, exponent, time, offset, symbol, instruction, order_id, activity_id,
+             execution_index) in rows:
+            leg = Leg(
+                quantity=quantity,
+                price=Decimal(mantissa).scaleb(exponent),
+                time=decode_time(time, offset),
+                instruction=self.instructions[instruction],
+                symbol=self.symbols[symbol],
+                order_id=order_id,
+                activity_id=None if activity_id == NULL_ID else activity_id
+            )
+            if execution_index != NULL_ID:
+                leg.execution_index = execution_index
+            legs.append(leg)
+        return legs
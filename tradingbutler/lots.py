@@ -0,0 +1,180 @@
+import heapq
+from collections import deque
+from operator import itemgetter
+
+from tradingbutler.records import Lot
+
+
+def _split_lot(lot, quantity):
+    lot.quantity -= quantity
+    return Lot(lot.symbol, lot.instruction, quantity, lot.price, lot.time, lot.order_id, lot.activity_id)
+
+
+# Every container relieves a closing quantity in amortized O(log n) or better per lot it touches, returns the relieved
+# lots in the order they were opened and iterates over the lots still open, also in the order they were opened. The
+# open quantity is checked before any lot is touched, so a rejected closing leaves the lots as they were. Costs are None
+# unless shares are carried at something other than their lot's price
+
+
+class FifoLots(deque):
+    __slots__ = ('quantity',)
+
+    def __init__(self, lots=()):
+        super().__init__(lots)
+        self.quantity = sum(lot.quantity for lot in self)
+
+    def append(self, lot):
+        super().append(lot)
+        self.quantity += lot.quantity
+
+    def relieve(self, quantity):
+        if quantity > self.quantity:
+            raise ValueError('closing more shares than open')
+        self.quantity -= quantity
+        relieved = []
+        while quantity:
+            lot = self[0]
+            if lot.quantity <= quantity:
+                self.popleft()
+                relieved.append(lot)
+                quantity -= lot.quantity
+            else:
+                relieved.append(_split_lot(lot, quantity))
+                quantity = 0
+        return relieved, None
+
+    def get_lots(self):
+        return self
+
+    def get_cost(self):
+        return None
+
+
+class LifoLots(list):
+    __slots__ = ('quantity',)
+
+    def __init__(self, lots=()):
+        super().__init__(lots)
+        self.quantity = sum(lot.quantity for lot in self)
+
+    def append(self, lot):
+        super().append(lot)
+        self.quantity += lot.quantity
+
+    def relieve(self, quantity):
+        if quantity > self.quantity:
+            raise ValueError('closing more shares than open')
+        self.quantity -= quantity
+        relieved = []
+        while quantity:
+            lot = self[-1]
+            if lot.quantity <= quantity:
+                self.pop()
+                relieved.append(lot)
+                quantity -= lot.quantity
+            else:
+                relieved.append(_split_lot(lot, quantity))
+                quantity = 0
+        relieved.reverse()
+        return relieved, None
+
+    def get_lots(self):
+        return self
+
+    def get_cost(self):
+        return None
+
+
+class HifoLots:
+    # A heap on the negated price, ties between equally priced lots go to the oldest one
+    __slots__ = ('_heap', '_count', 'quantity')
+
+    def __init__(self, lots=()):
+        self._heap = []
+        self._count = 0
+        self.quantity = 0
+        for lot in lots:
+            self.append(lot)
+
+    def __len__(self):
+        return len(self._heap)
+
+    def __iter__(self):
+        return iter(self.get_lots())
+
+    def append(self, lot):
+        heapq.heappush(self._heap, (-lot.price, self._count, lot))
+        self._count += 1
+        self.quantity += lot.quantity
+
+    def relieve(self, quantity):
+        if quantity > self.quantity:
+            raise ValueError('closing more shares than open')
+        self.quantity -= quantity
+        relieved = []
+        while quantity:
+            entry = self._heap[0]
+            lot = entry[2]
+            if lot.quantity <= quantity:
+                heapq.heappop(self._heap)
+                relieved.append(entry)
+                quantity -= lot.quantity
+            else:
+                # The remainder keeps its price, so it stays where it is in the heap
+                relieved.append((entry[0], entry[1], _split_lot(lot, quantity)))
+                quantity = 0
+        relieved.sort(key=itemgetter(1))
+        return [entry[2] for entry in relieved], None
+
+    def get_lots(self):
+        return [entry[2] for entry in sorted(self._heap, key=itemgetter(1))]
+
+    def get_cost(self):
+        return None
+
+
+class AverageCostLots:
+    # Lots are identified first in, first out, but every share is carried at the running average cost
+    __slots__ = ('_lots', 'quantity', 'cost')
+
+    def __init__(self, lots=()):
+        self._lots = FifoLots()
+        self.quantity = 0
+        self.cost = 0
+        for lot in lots:
+            self.append(lot)
+
+    def __len__(self):
+        return len(self._lots)
+
+    def __iter__(self):
+        return iter(self._lots)
+
+    def append(self, lot):
+        self._lots.append(lot)
+        self.quantity += lot.quantity
+        self.cost += lot.price * lot.quantity
+
+    def relieve(self, quantity):
+        if quantity > self.quantity:
+            raise ValueError('closing more shares than open')
+        # One division, so the cost is only rounded once, when it becomes the position's risk
+        cost = self.cost if quantity == self.quantity else self.cost * quantity / self.quantity
+        relieved, _ = self._lots.relieve(quantity)
+        self.quantity -= quantity
+        self.cost -= cost
+        return relieved, cost
+
+    def get_lots(self):
+        return self._lots
+
+    def get_cost(self):
+        return self.cost
+
+
+RELIEF_METHODS = {
+    'fifo': FifoLots,
+    'lifo': LifoLots,
+    'hifo': HifoLots,
+    'average': AverageCostLots,
+}
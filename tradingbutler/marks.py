@@ -0,0 +1,109 @@
+import csv
+import datetime
+import hashlib
+import json
+from decimal import Decimal
+
+from tradingbutler.cache import get_file_digest
+from tradingbutler.summary import get_closing_values
+from tradingbutler.summary import iter_position_summaries
+from tradingbutler.times import parse_time
+
+
+def _get_prices_digest(prices):
+    digest = hashlib.blake2b(digest_size=20)
+    for symbol, price in sorted(prices.items()):
+        digest.update('{}\t{}\n'.format(symbol, price).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class PriceSnapshot:
+    def __init__(self, prices, times=None, version=None):
+        self.prices = prices
+        self.times = {} if times is None else times
+        # Snapshots built in code are versioned by their prices, so different prices never share cached marks
+        self.version = _get_prices_digest(prices) if version is None else version
+
+    def __len__(self):
+        return len(self.prices)
+
+    def get_price(self, symbol):
+        return self.prices.get(symbol)
+
+    @classmethod
+    def from_path(cls, path):
+        # The version is the content digest, so rewriting the same marks keeps cached results valid
+        prices = {}
+        times = {}
+        if str(path).endswith('.csv'):
+            with open(path, newline='') as f:
+                rows = list(csv.DictReader(f))
+        else:
+            with open(path) as f:
+                data = json.load(f, parse_float=Decimal)
+            if isinstance(data, dict):
+                rows = [dict(value, symbol=symbol) if isinstance(value, dict) else {'symbol': symbol, 'price': value}
+                        for symbol, value in data.items()]
+            else:
+                rows = data
+        for row in rows:
+            symbol = row['symbol']
+            price = row['price']
+            prices[symbol] = price if isinstance(price, Decimal) else Decimal(price)
+            if row.get('time'):
+                times[symbol] = parse_time(row['time'])
+        return cls(prices, times, get_file_digest(path))
+
+
+def mark_position(position, price, current_date=None):
+    opening = position['opening']
+    position_summary = next(iter_position_summaries([position], current_date))
+    # Valued as if the whole position were closed at the mark
+    closing = {'price': price, 'instruction': 'SELL' if opening['instruction'] == 'BUY' else 'BUY_TO_COVER'}
+    exit_price, profit, profit_percentage = get_closing_values(opening, closing)
+    position_summary['exit_price'] = exit_price
+    position_summary['profit'] = profit
+    position_summary['profit_percentage'] = profit_percentage
+    return position_summary
+
+
+class MarkToMarket:
+    def __init__(self, max_versions=2):
+        self.max_versions = max_versions
+        self._marks = {}
+
+    def mark(self, open_positions, snapshot, current_date=None):
+        if current_date is None:
+            current_date = datetime.datetime.now().date()
+        marks = self._marks.get(snapshot.version)
+        if marks is None:
+            marks = self._marks[snapshot.version] = {}
+            while len(self._marks) > self.max_versions:
+                del self._marks[next(iter(self._marks))]
+        # A position is re-marked only when its lots changed since this snapshot version was last applied
+        position_summaries = []
+        for position in open_positions:
+            opening = position['opening']
+            symbol = opening['symbol']
+            cached = marks.get(symbol)
+            if cached is not None and cached[0] is opening and cached[1] == current_date:
+                position_summaries.append(cached[2])
+                continue
+            price = snapshot.get_price(symbol)
+            if price is None:
+                position_summary = next(iter_position_summaries([position], current_date))
+            else:
+                position_summary = mark_position(position, price, current_date)
+            marks[symbol] = (opening, current_date, position_summary)
+            position_summaries.append(position_summary)
+        return position_summaries
+
+
+def iter_marked_summaries(positions, snapshot, current_date=None, marker=None):
+    if marker is None:
+        marker = MarkToMarket()
+    for position in positions:
+        if position.get('closing') is None:
+            yield from marker.mark([position], snapshot, current_date)
+        else:
+            yield from iter_position_summaries([position], current_date)
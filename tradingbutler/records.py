@@ -0,0 +1,94 @@
+from collections.abc import Mapping
+
+
+_MISSING = object()
+
+
+class Record(Mapping):
+    __slots__ = ()
+    fields = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Generate a plain __init__ per record type, as namedtuple and dataclasses do; unset fields stay absent keys
+        arguments = ''.join(', {}=_MISSING'.format(name) for name in cls.fields)
+        body = ''.join('\n    if {0} is not _MISSING:\n        self.{0} = {0}'.format(name) for name in cls.fields)
+        namespace = {'_MISSING': _MISSING}
+        exec('def __init__(self{}):{}'.format(arguments, body or '\n    pass'), namespace)
+        cls.__init__ = namespace['__init__']
+
+    def __getitem__(self, key):
+        if key in self.fields:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                pass
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self.fields:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.fields and hasattr(self, key)
+
+    def __iter__(self):
+        for name in self.fields:
+            if hasattr(self, name):
+                yield name
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__,
+                               ', '.join('{}={!r}'.format(key, value) for key, value in self.items()))
+
+    def __reduce__(self):
+        # Straight off the slots, dict(self) would go through the Mapping protocol once per field
+        state = {}
+        for name in self.fields:
+            value = getattr(self, name, _MISSING)
+            if value is not _MISSING:
+                state[name] = value
+        return type(self), (), state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def replace(self, **kwargs):
+        return type(self)(**dict(self, **kwargs))
+
+
+class Leg(Record):
+    fields = ('quantity', 'price', 'time', 'instruction', 'symbol', 'order_id', 'activity_id', 'execution_index')
+    __slots__ = fields
+
+
+class Lot(Record):
+    fields = ('symbol', 'instruction', 'quantity', 'price', 'time', 'order_id', 'activity_id')
+    __slots__ = fields
+
+
+class PositionLeg(Record):
+    fields = ('symbol', 'instruction', 'quantity', 'price', 'time', 'risk')
+    __slots__ = fields
+
+
+class Position(Record):
+    fields = ('opening', 'closing', 'order_ids', 'activity_ids')
+    __slots__ = fields
+
+
+class PositionSummary(Record):
+    fields = ('symbol', 'risk', 'entry_date', 'average_price', 'exit_price', 'exit_date', 'days', 'quantity',
+              'direction', 'profit', 'profit_percentage', 'number_legs', 'order_ids', 'activity_ids')
+    __slots__ = fields
+
+
+class Aggregate(Record):
+    fields = ('grouping', 'key', 'positions', 'open', 'closed', 'wins', 'losses', 'win_rate', 'total_profit',
+              'expectancy', 'average_win', 'average_loss', 'average_days', 'total_risk')
+    __slots__ = fields
@@ -0,0 +1,123 @@
+import datetime
+from decimal import Decimal
+
+from tradingbutler.records import Leg
+from tradingbutler.records import PositionLeg
+from tradingbutler.records import PositionSummary
+
+PLACES = 4
+PERCENTAGE_PLACES = 2
+SCALE = 10 ** PLACES
+_UNIT = Decimal(1).scaleb(-PLACES)
+_PERCENTAGE_UNIT = Decimal(1).scaleb(-PERCENTAGE_PLACES)
+
+
+def to_scaled(value):
+    if isinstance(value, int):
+        return value * SCALE
+    scaled = value.scaleb(PLACES)
+    integer = int(scaled)
+    if integer != scaled:
+        raise ValueError('{} has more than {} decimal places'.format(value, PLACES))
+    return integer
+
+
+def from_scaled(value, unit=_UNIT, negative_zero=False):
+    if negative_zero:
+        return Decimal(0).copy_negate() * unit
+    return Decimal(value) * unit
+
+
+# The helpers below take ints or, for the numpy backend, int64 arrays
+
+
+def round_half_up(numerator, denominator):
+    # Decimal's ROUND_HALF_UP rounds ties away from zero
+    quotient = (2 * abs(numerator) + denominator) // (2 * denominator)
+    return quotient - 2 * quotient * (numerator < 0)
+
+
+def is_negative_zero(rounded, value, cover):
+    # The Decimal path yields -0 when a negative value rounds to zero or a short's zero is negated
+    return (rounded == 0) & ((value < 0) != cover)
+
+
+def scale_legs(legs):
+    return [Leg(
+        quantity=leg['quantity'],
+        price=to_scaled(leg['price']),
+        time=leg['time'],
+        instruction=leg['instruction'],
+        symbol=leg['symbol'],
+        order_id=leg['order_id'],
+        activity_id=leg.get('activity_id'),
+        execution_index=leg.get('execution_index')
+    ) for leg in legs]
+
+
+def scale_prices(legs):
+    # In place, for legs an importer has just built
+    for leg in legs:
+        leg['price'] = to_scaled(leg['price'])
+
+
+def get_opening_leg(lots, risk=None):
+    quantity = sum(lot.quantity for lot in lots)
+    if risk is None:
+        risk = sum(lot.price * lot.quantity for lot in lots)
+    return PositionLeg(
+        symbol=lots[0].symbol,
+        instruction=lots[0].instruction,
+        quantity=quantity,
+        price=round_half_up(risk, quantity),
+        time=lots[0].time,
+        risk=risk
+    )
+
+
+def iter_position_summaries(positions, current_date=None):
+    # Same results as the Decimal path, every intermediate value stays an exact integer in 1e-4 units
+    if current_date is None:
+        current_date = datetime.datetime.now().date()
+    for position in positions:
+        order_ids = position['order_ids']
+        opening = position['opening']
+        closing = position.get('closing')
+        quantity = opening['quantity']
+        price = opening['price']
+        entry_date = opening['time'].date()
+        if closing is not None:
+            closing_price = closing['price']
+            cover = 'BUY_TO_COVER' in closing['instruction']
+            profit = quantity * closing_price - opening['risk']
+            change = closing_price - price
+            profit_percentage = round_half_up(10 ** (PERCENTAGE_PLACES + 2) * change, price)
+            exit_price = from_scaled(closing_price)
+            exit_date = closing['time'].date()
+            days = (exit_date - entry_date).days
+            rounded_profit = from_scaled(-profit if cover else profit,
+                                         negative_zero=is_negative_zero(profit, profit, cover))
+            profit_percentage = from_scaled(-profit_percentage if cover else profit_percentage, _PERCENTAGE_UNIT,
+                                            is_negative_zero(profit_percentage, change, cover))
+        else:
+            exit_price = None
+            exit_date = None
+            rounded_profit = None
+            profit_percentage = None
+            days = (current_date - entry_date).days
+        yield PositionSummary(
+            symbol=opening['symbol'],
+            risk=from_scaled(opening['risk']),
+            entry_date=entry_date,
+            average_price=from_scaled(price),
+            exit_price=exit_price,
+            exit_date=exit_date,
+            days=days,
+            quantity=quantity,
+            direction='Long' if opening['instruction'] == 'BUY' else 'Short',
+            profit=rounded_profit,
+            profit_percentage=profit_percentage,
+            number_legs=len(set(order_ids)),
+            order_ids=order_ids,
+            activity_ids=position['activity_ids']
+        )
@@ -0,0 +1,252 @@
+import json
+import sqlite3
+from decimal import Decimal
+
+from tradingbutler.records import Leg
+from tradingbutler.records import Lot
+from tradingbutler.records import Position
+from tradingbutler.records import PositionLeg
+from tradingbutler.summary import PositionBook
+from tradingbutler.summary import import_paths
+from tradingbutler.times import decode_time
+from tradingbutler.times import encode_time
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS legs (
+    id INTEGER PRIMARY KEY,
+    symbol TEXT NOT NULL,
+    instruction TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    price TEXT NOT NULL,
+    time INTEGER NOT NULL,
+    utc_offset INTEGER NOT NULL,
+    order_id INTEGER NOT NULL,
+    activity_id INTEGER,
+    execution_index INTEGER
+);
+CREATE INDEX IF NOT EXISTS legs_symbol ON legs (symbol);
+CREATE INDEX IF NOT EXISTS legs_time ON legs (time);
+CREATE INDEX IF NOT EXISTS legs_order_id ON legs (order_id);
+CREATE UNIQUE INDEX IF NOT EXISTS legs_key ON legs (order_id, IFNULL(activity_id, -1), IFNULL(execution_index, -1));
+CREATE TABLE IF NOT EXISTS positions (
+    id INTEGER PRIMARY KEY,
+    symbol TEXT NOT NULL,
+    instruction TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    price TEXT NOT NULL,
+    risk TEXT NOT NULL,
+    time INTEGER NOT NULL,
+    utc_offset INTEGER NOT NULL,
+    closing_instruction TEXT NOT NULL,
+    closing_price TEXT NOT NULL,
+    closing_time INTEGER NOT NULL,
+    closing_utc_offset INTEGER NOT NULL,
+    order_ids TEXT NOT NULL,
+    activity_ids TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS positions_symbol ON positions (symbol);
+CREATE INDEX IF NOT EXISTS positions_time ON positions (time);
+CREATE INDEX IF NOT EXISTS positions_closing_time ON positions (closing_time);
+CREATE TABLE IF NOT EXISTS symbols (
+    id INTEGER PRIMARY KEY,
+    symbol TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS lots (
+    id INTEGER PRIMARY KEY,
+    symbol TEXT NOT NULL,
+    instruction TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    price TEXT NOT NULL,
+    time INTEGER NOT NULL,
+    utc_offset INTEGER NOT NULL,
+    order_id INTEGER NOT NULL,
+    activity_id INTEGER
+);
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+'''
+
+
+def _get_sort_key(leg):
+    time, _ = encode_time(leg['time'])
+    return time, leg['order_id'], leg.get('activity_id') or 0, leg.get('execution_index') or 0
+
+
+class TradeStore:
+    def __init__(self, path=':memory:', relief='fifo'):
+        self.path = path
+        self.relief = relief
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+        # The open lots are stored as the relief method left them, so a store keeps the method it was first used with
+        row = self.connection.execute("SELECT value FROM state WHERE key = 'relief'").fetchone()
+        if row is not None and row[0] != relief:
+            self.connection.close()
+            raise ValueError('store was matched with {} relief, not {}'.format(row[0], relief))
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get_high_water_mark(self):
+        row = self.connection.execute("SELECT value FROM state WHERE key = 'high_water_mark'").fetchone()
+        return tuple(json.loads(row[0])) if row is not None else None
+
+    def ingest(self, legs):
+        # Executions already stored are skipped through the legs_key index, mirroring get_leg_key
+        with self.connection:
+            new_legs = [leg for leg in legs if self.connection.execute(
+                'INSERT OR IGNORE INTO legs (symbol, instruction, quantity, price, time, utc_offset, order_id, '
+                'activity_id, execution_index) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                self._get_leg_row(leg) + (leg.get('execution_index'),)).rowcount]
+            if not new_legs:
+                return 0
+            new_legs.sort(key=_get_sort_key)
+            high_water_mark = self.get_high_water_mark()
+            if high_water_mark is None or _get_sort_key(new_legs[0]) > high_water_mark:
+                book = self._load_book()
+                book.add_legs(new_legs)
+            else:
+                # Another account or a backfilled export reaches behind what was already matched, only a rebuild from
+                # every stored leg keeps relief order
+                book = PositionBook(relief=self.relief)
+                book.add_legs(self.get_legs())
+                self.connection.execute('DELETE FROM positions')
+                self.connection.execute('DELETE FROM symbols')
+            self.connection.executemany(
+                'INSERT INTO positions (symbol, instruction, quantity, price, risk, time, utc_offset, '
+                'closing_instruction, closing_price, closing_time, closing_utc_offset, order_ids, activity_ids) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (self._get_position_row(position) for position in book.closed_positions))
+            self.connection.executemany('INSERT OR IGNORE INTO symbols (symbol) VALUES (?)',
+                                        ((symbol,) for symbol in book.current_positions))
+            self.connection.execute('DELETE FROM lots')
+            self.connection.executemany(
+                'INSERT INTO lots (symbol, instruction, quantity, price, time, utc_offset, order_id, activity_id) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (self._get_leg_row(lot) for lots in book.current_positions.values() for lot in lots))
+            # Average cost lots keep their own prices, the running cost they are carried at is stored next to them
+            costs = {symbol: str(lots.get_cost()) for symbol, lots in book.current_positions.items()
+                     if len(lots) and lots.get_cost() is not None}
+            self.connection.execute("INSERT OR REPLACE INTO state (key, value) VALUES ('costs', ?)",
+                                    (json.dumps(costs),))
+            self.connection.execute("INSERT OR REPLACE INTO state (key, value) VALUES ('relief', ?)", (self.relief,))
+            self.connection.execute("INSERT OR REPLACE INTO state (key, value) VALUES ('high_water_mark', ?)",
+                                    (json.dumps(max(high_water_mark or (), _get_sort_key(new_legs[-1]))),))
+        return len(new_legs)
+
+    def ingest_paths(self, paths, **kwargs):
+        return self.ingest(import_paths(paths, **kwargs))
+
+    def _load_book(self):
+        book = PositionBook(relief=self.relief)
+        # Every symbol seen so far is seeded in first-seen order, so open positions keep the order a full rebuild has
+        for symbol, in self.connection.execute('SELECT symbol FROM symbols ORDER BY id'):
+            book.current_positions[symbol] = book.lots_class()
+        for row in self.connection.execute('SELECT symbol, instruction, quantity, price, time, utc_offset, order_id, '
+                                           'activity_id FROM lots ORDER BY id'):
+            symbol, instruction, quantity, price, time, utc_offset, order_id, activity_id = row
+            book.current_positions[symbol].append(Lot(
+                symbol=symbol,
+                instruction=instruction,
+                quantity=quantity,
+                price=Decimal(price),
+                time=decode_time(time, utc_offset),
+                order_id=order_id,
+                activity_id=activity_id
+            ))
+        row = self.connection.execute("SELECT value FROM state WHERE key = 'costs'").fetchone()
+        if row is not None:
+            for symbol, cost in json.loads(row[0]).items():
+                book.current_positions[symbol].cost = Decimal(cost)
+        return book
+
+    @staticmethod
+    def _get_leg_row(leg):
+        time, utc_offset = encode_time(leg['time'])
+        return (leg['symbol'], leg['instruction'], leg['quantity'], str(leg['price']), time, utc_offset,
+                leg['order_id'], leg.get('activity_id'))
+
+    @staticmethod
+    def _get_position_row(position):
+        opening = position['opening']
+        closing = position['closing']
+        time, utc_offset = encode_time(opening['time'])
+        closing_time, closing_utc_offset = encode_time(closing['time'])
+        return (opening['symbol'], opening['instruction'], opening['quantity'], str(opening['price']),
+                str(opening['risk']), time, utc_offset, closing['instruction'], str(closing['price']), closing_time,
+                closing_utc_offset, json.dumps(position['order_ids']), json.dumps(position['activity_ids']))
+
+    def get_legs(self, symbol=None, start=None, end=None):
+        query, parameters = self._get_filter('time', symbol, start, end)
+        rows = self.connection.execute(
+            'SELECT quantity, price, time, utc_offset, instruction, symbol, order_id, activity_id, execution_index '
+            'FROM legs' + query + ' ORDER BY time, order_id, IFNULL(activity_id, 0), IFNULL(execution_index, 0), id',
+            parameters)
+        return [Leg(
+            quantity=quantity,
+            price=Decimal(price),
+            time=decode_time(time, utc_offset),
+            instruction=instruction,
+            symbol=symbol,
+            order_id=order_id,
+            activity_id=activity_id,
+            execution_index=execution_index
+        ) for quantity, price, time, utc_offset, instruction, symbol, order_id, activity_id, execution_index in rows]
+
+    def get_positions(self, symbol=None, start=None, end=None):
+        # start and end bound the closing time; open positions are included unless an end is given
+        query, parameters = self._get_filter('closing_time', symbol, start, end)
+        positions = []
+        rows = self.connection.execute(
+            'SELECT symbol, instruction, quantity, price, risk, time, utc_offset, closing_instruction, closing_price, '
+            'closing_time, closing_utc_offset, order_ids, activity_ids FROM positions' + query + ' ORDER BY id',
+            parameters)
+        for row in rows:
+            (row_symbol, instruction, quantity, price, risk, time, utc_offset, closing_instruction, closing_price,
+             closing_time, closing_utc_offset, order_ids, activity_ids) = row
+            positions.append(Position(
+                opening=PositionLeg(
+                    symbol=row_symbol,
+                    instruction=instruction,
+                    quantity=quantity,
+                    price=Decimal(price),
+                    time=decode_time(time, utc_offset),
+                    risk=Decimal(risk)
+                ),
+                closing=PositionLeg(
+                    symbol=row_symbol,
+                    instruction=closing_instruction,
+                    quantity=quantity,
+                    price=Decimal(closing_price),
+                    time=decode_time(closing_time, closing_utc_offset)
+                ),
+                order_ids=json.loads(order_ids),
+                activity_ids=json.loads(activity_ids)
+            ))
+        if end is None:
+            positions.extend(position for position in self._load_book().get_open_positions()
+                             if symbol is None or position['opening']['symbol'] == symbol)
+        return positions
+
+    @staticmethod
+    def _get_filter(column, symbol, start, end):
+        conditions = []
+        parameters = []
+        if symbol is not None:
+            conditions.append('symbol = ?')
+            parameters.append(symbol)
+        if start is not None:
+            conditions.append('{} >= ?'.format(column))
+            parameters.append(encode_time(start)[0])
+        if end is not None:
+            conditions.append('{} < ?'.format(column))
+            parameters.append(encode_time(end)[0])
+        return (' WHERE ' + ' AND '.join(conditions) if conditions else ''), parameters
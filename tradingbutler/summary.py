@@ -1,238 +1,747 @@
+import codecs
 import datetime
+import glob
+import heapq
 import json
-from collections import deque
+import os
+import re
+from array import array
+from collections.abc import Mapping
 from decimal import ROUND_HALF_UP
 from decimal import Decimal
+from functools import lru_cache
 
-from dateutil.parser import parse
-from jinja2 import Environment
-from jinja2 import PackageLoader
-from jinja2 import select_autoescape
+from tradingbutler import scaled as scaled_numeric
+from tradingbutler.cache import LegCache
+from tradingbutler.dedup import iter_unique_legs
+from tradingbutler.instrumentation import PipelineStats
+from tradingbutler.instrumentation import get_active_stats
+from tradingbutler.instrumentation import instrumented
+from tradingbutler.instrumentation import run_stage
+from tradingbutler.lots import RELIEF_METHODS
+from tradingbutler.records import Leg
+from tradingbutler.records import Lot
+from tradingbutler.records import Position
+from tradingbutler.records import PositionLeg
+from tradingbutler.records import PositionSummary
+from tradingbutler.times import parse_time
 
-env = Environment(
-    loader=PackageLoader(__package__),
-    autoescape=select_autoescape()
-)
+
+@lru_cache(maxsize=None)
+def get_environment():
+    # jinja2 is imported on first render so importing or matching trades does not pay for it
+    from jinja2 import Environment
+    from jinja2 import FileSystemBytecodeCache
+    from jinja2 import PackageLoader
+    from jinja2 import select_autoescape
+
+    cache_dir = os.environ.get('TRADINGBUTLER_TEMPLATE_CACHE')
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+    return Environment(
+        loader=PackageLoader(__package__),
+        autoescape=select_autoescape(),
+        bytecode_cache=FileSystemBytecodeCache(cache_dir or None)
+    )
+
+
+def precompile_templates():
+    environment = get_environment()
+    for name in environment.list_templates():
+        environment.get_template(name)
+
+
+def __getattr__(name):
+    if name == 'env':
+        return get_environment()
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+class _JsonStreamReader:
+    def __init__(self, f, chunk_size, decoder):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = decoder
+        self.text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.pos = 0
+        self.byte_pos = 0
+        self.eof = False
+
+    def fill(self):
+        self.buffer = self.buffer[self.pos:]
+        self.pos = 0
+        # Grow reads geometrically so a single large value is not re-decoded once per chunk
+        chunk = self.f.read(max(self.chunk_size, len(self.buffer)))
+        self.eof = not chunk
+        self.buffer += self.text_decoder.decode(chunk, final=self.eof)
+
+    def advance(self, pos):
+        self.byte_pos += len(self.buffer[self.pos:pos].encode('utf-8'))
+        self.pos = pos
+
+    def peek(self):
+        while True:
+            self.advance(_WHITESPACE.match(self.buffer, self.pos).end())
+            if self.pos < len(self.buffer) or self.eof:
+                return self.buffer[self.pos:self.pos + 1]
+            self.fill()
+
+    def read_value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                self.fill()
+                continue
+            # A value ending exactly at the buffer boundary may continue in the next chunk
+            if end == len(self.buffer) and not self.eof:
+                self.fill()
+                continue
+            self.advance(end)
+            return value
+
+
+def _iter_json_values(f, chunk_size, decoder):
+    reader = _JsonStreamReader(f, chunk_size, decoder)
+    if reader.peek() != '[':
+        start = reader.byte_pos
+        yield reader.read_value(), (start, reader.byte_pos)
+    else:
+        reader.advance(reader.pos + 1)
+        if reader.peek() == ']':
+            reader.advance(reader.pos + 1)
+        else:
+            while True:
+                reader.peek()
+                start = reader.byte_pos
+                yield reader.read_value(), (start, reader.byte_pos)
+                delimiter = reader.peek()
+                reader.advance(reader.pos + 1)
+                if delimiter == ']':
+                    break
+                if delimiter != ',':
+                    raise ValueError('expecting , delimiter in JSON array')
+    if reader.peek():
+        raise ValueError('extra data after JSON value')
+
+
+def iter_json_array(path, reverse=False, chunk_size=65536, parse_float=Decimal):
+    decoder = json.JSONDecoder(parse_float=parse_float)
+    with open(path, 'rb') as f:
+        if not reverse:
+            for value, _ in _iter_json_values(f, chunk_size, decoder):
+                yield value
+            return
+        # Only the byte span of each element is kept, as two machine integers, so the one element decoded at a time
+        # dominates memory rather than the number of elements
+        starts = array('q')
+        ends = array('q')
+        for _, (start, end) in _iter_json_values(f, chunk_size, decoder):
+            starts.append(start)
+            ends.append(end)
+        for i in range(len(starts) - 1, -1, -1):
+            f.seek(starts[i])
+            yield decoder.decode(f.read(ends[i] - starts[i]).decode('utf-8'))
 
 
 class BaseTradeImporter:
-    def __init__(self, json_string, descending=False):
-        parsed = json.loads(json_string, parse_float=Decimal)
+    def __init__(self, json_string=None, descending=False, legs=None, scaled=False):
+        self.descending = descending
+        if legs is not None:
+            self.trades = None
+            self.legs = legs
+            return
+        parsed = run_stage('json_decode', json.loads, json_string, parse_float=Decimal)
         if isinstance(parsed, list):
             self.trades = parsed
         elif isinstance(parsed, dict):
             self.trades = [parsed]
         else:
             raise ValueError
-        self.descending = descending
-        self.legs = self.get_legs(self.trades)
+        self.legs = run_stage('get_legs', self.get_legs, self.trades)
+        if scaled:
+            scaled_numeric.scale_prices(self.legs)
 
     @classmethod
-    def from_path(cls, path):
-        json_string = cls.read_file(cls, path)
-        return cls(json_string)
+    def from_path(cls, path, descending=False, cache_dir=None, scaled=False):
+        if cache_dir is None:
+            json_string = cls.read_file(cls, path)
+            return cls(json_string, descending=descending, scaled=scaled)
+        cache = LegCache(cache_dir)
+        namespace = '{}:{}'.format(cls.__qualname__, descending)
+        legs = cache.load(path, namespace)
+        if legs is None:
+            legs = cls(cls.read_file(cls, path), descending=descending).legs
+            cache.store(path, legs, namespace)
+        # The cache always holds Decimal prices, the loaded legs are fresh and may be scaled in place
+        if scaled:
+            scaled_numeric.scale_prices(legs)
+        return cls(descending=descending, legs=legs)
+
+    @classmethod
+    def iter_path(cls, path, descending=False, chunk_size=65536):
+        for trade in iter_json_array(path, reverse=not descending, chunk_size=chunk_size):
+            if not isinstance(trade, dict):
+                raise ValueError
+            yield from cls.get_trade_legs(trade)
+
+    @classmethod
+    def iter_sorted_path(cls, path, descending=False, chunk_size=65536):
+        # Orders are listed by the time they were entered and no fill comes before its order was, so a leg older than
+        # the next order's entry can no longer be overtaken; only legs of orders possibly still filling are held back
+        held = []
+        count = 0
+        bound = None
+        for trade in iter_json_array(path, reverse=not descending, chunk_size=chunk_size):
+            if not isinstance(trade, dict):
+                raise ValueError
+            entered_time = cls.get_entered_time(trade)
+            if entered_time is not None:
+                bound = entered_time if bound is None else max(bound, entered_time)
+                while held and held[0][0][0] < bound:
+                    yield heapq.heappop(held)[2]
+            for leg in cls.get_trade_legs(trade):
+                if bound is not None and leg['time'] < bound:
+                    raise ValueError('{} does not list orders by the time they were entered'.format(path))
+                # The count keeps legs sharing a key in the order the export lists them, as a stable sort would
+                heapq.heappush(held, (get_leg_sort_key(leg), count, leg))
+                count += 1
+        while held:
+            yield heapq.heappop(held)[2]
 
     def read_file(self, path):
         with open(path, 'r') as f:
             json_string = f.read()
         return json_string
 
-    def get_legs(self, trades):
-        raise NotImplementedError
-
-
-class TdaTradeImporter(BaseTradeImporter):
     def get_legs(self, trades):
         if not self.descending:
             trades = reversed(trades)
         legs = []
         for trade in trades:
-            instruction = None
-            symbol = None
-            order_id = trade['orderId']
-            for order_leg in trade['orderLegCollection']:
-                instruction = order_leg['instruction']
-                symbol = order_leg['instrument']['symbol']
-
-            if 'orderActivityCollection' in trade:
-                activities = sorted(trade['orderActivityCollection'], key=lambda x: x['activityId'])
-                for order_activity in activities:
-                    for execution_leg in order_activity['executionLegs']:
-                        legs.append({
-                            'quantity': int(execution_leg['quantity']),
-                            'price': execution_leg['price'],
-                            'time': parse(execution_leg['time']),
-                            'instruction': instruction,
-                            'symbol': symbol,
-                            'order_id': order_id,
-                            'activity_id': order_activity['activityId'],
-                        })
-
+            legs.extend(self.get_trade_legs(trade))
         return legs
 
+    @staticmethod
+    def get_trade_legs(trade):
+        raise NotImplementedError
 
-def get_positions(legs):
-    positions = []
-    current_positions = {}
-    for leg in legs:
-        if not leg['symbol'] in current_positions:
-            current_positions[leg['symbol']] = deque()
+    @staticmethod
+    def get_entered_time(trade):
+        return None
+
+
+class TdaTradeImporter(BaseTradeImporter):
+    @staticmethod
+    def get_entered_time(trade):
+        entered_time = trade.get('enteredTime')
+        return None if entered_time is None else parse_time(entered_time)
+
+    @staticmethod
+    def get_trade_legs(trade):
+        instruction = None
+        symbol = None
+        order_id = trade['orderId']
+        for order_leg in trade['orderLegCollection']:
+            instruction = order_leg['instruction']
+            symbol = order_leg['instrument']['symbol']
+
+        if 'orderActivityCollection' in trade:
+            activities = sorted(trade['orderActivityCollection'], key=lambda x: x['activityId'])
+            for order_activity in activities:
+                for execution_index, execution_leg in enumerate(order_activity['executionLegs']):
+                    yield Leg(
+                        quantity=int(execution_leg['quantity']),
+                        price=execution_leg['price'],
+                        time=parse_time(execution_leg['time']),
+                        instruction=instruction,
+                        symbol=symbol,
+                        order_id=order_id,
+                        activity_id=order_activity['activityId'],
+                        execution_index=execution_index,
+                    )
+
+
+def _import_legs(importer_class, path, descending, cache_dir, scaled):
+    return importer_class.from_path(path, descending=descending, cache_dir=cache_dir, scaled=scaled).legs
+
+
+def _import_columns(importer_class, path, descending, cache_dir, scaled, trace_memory):
+    if trace_memory is None:
+        legs = _import_legs(importer_class, path, descending, cache_dir, scaled)
+        stages = None
+    else:
+        # A worker has no stats of its own active, its stages are timed here and recorded by the parent
+        with PipelineStats(trace_memory=trace_memory) as stats:
+            legs = _import_legs(importer_class, path, descending, cache_dir, scaled)
+        stages = [(stage.name, stage.seconds, stage.rows, stage.peak_bytes) for stage in stats.stages.values()]
+    # Legs leave a worker as columns, which pickle far faster than one record, and one Decimal, per leg; datetimes
+    # pickle cheaply and share their tzinfo, so times go as they are
+    symbols = {}
+    instructions = {}
+    columns = (
+        [symbols.setdefault(leg['symbol'], len(symbols)) for leg in legs],
+        [instructions.setdefault(leg['instruction'], len(instructions)) for leg in legs],
+        [leg['quantity'] for leg in legs],
+        [leg['price'] for leg in legs] if scaled else [str(leg['price']) for leg in legs],
+        [leg['time'] for leg in legs],
+        [leg['order_id'] for leg in legs],
+        [leg.get('activity_id') for leg in legs],
+        [leg.get('execution_index') for leg in legs],
+        list(symbols),
+        list(instructions)
+    )
+    return columns, stages
+
+
+def _decode_columns(columns, scaled):
+    (symbol_ids, instruction_ids, quantities, prices, times, order_ids, activity_ids, execution_indexes, symbols,
+     instructions) = columns
+    if not scaled:
+        prices = map(Decimal, prices)
+    legs = []
+    for symbol, instruction, quantity, price, time, order_id, activity_id, execution_index in zip(
+            symbol_ids, instruction_ids, quantities, prices, times, order_ids, activity_ids, execution_indexes):
+        leg = Leg(quantity=quantity, price=price, time=time,
+                  instruction=instructions[instruction], symbol=symbols[symbol], order_id=order_id)
+        if activity_id is not None:
+            leg.activity_id = activity_id
+        if execution_index is not None:
+            leg.execution_index = execution_index
+        legs.append(leg)
+    return legs
+
+
+def get_leg_sort_key(leg):
+    return leg['time'], leg['order_id'], leg.get('activity_id') or 0
+
+
+@instrumented('import')
+def import_paths(paths, importer_class=TdaTradeImporter, processes=None, descending=False, cache_dir=None,
+                 deduplicate=True, scaled=False):
+    if isinstance(paths, str):
+        paths = sorted(glob.glob(paths))
+    arguments = [(importer_class, path, descending, cache_dir, scaled) for path in paths]
+    if processes == 1 or len(arguments) <= 1:
+        results = [_import_legs(*argument) for argument in arguments]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        stats = get_active_stats()
+        trace_memory = None if stats is None else stats.trace_memory
+        results = []
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            for columns, stages in executor.map(_import_columns, *zip(*arguments), [trace_memory] * len(arguments)):
+                results.append(_decode_columns(columns, scaled))
+                for stage in stages or ():
+                    stats.record(*stage)
+    legs = [leg for result in results for leg in result]
+    if deduplicate:
+        # Overlapping exports repeat executions, only the first copy of each is kept
+        legs = list(iter_unique_legs(legs))
+    # sort() is stable, so legs sharing a key keep their file and execution order
+    legs.sort(key=get_leg_sort_key)
+    return legs
+
+
+def merge_legs(streams):
+    # Every stream has to be in get_leg_sort_key order already; legs sharing a key keep the order of their streams,
+    # as the stable sort in import_paths does
+    return heapq.merge(*streams, key=get_leg_sort_key)
+
+
+def iter_merged_paths(paths, importer_class=TdaTradeImporter, descending=False, deduplicate=True):
+    if isinstance(paths, str):
+        paths = sorted(glob.glob(paths))
+    legs = merge_legs([importer_class.iter_sorted_path(path, descending=descending) for path in paths])
+    if deduplicate:
+        legs = iter_unique_legs(legs)
+    return legs
+
+
+def _get_opening_leg(lots, risk=None):
+    quantity = sum(lot.quantity for lot in lots)
+    if risk is None:
+        risk = sum(lot.price * lot.quantity for lot in lots)
+    average_price = (risk / quantity).quantize(Decimal('.0001'), ROUND_HALF_UP)
+    return PositionLeg(
+        symbol=lots[0].symbol,
+        instruction=lots[0].instruction,
+        quantity=quantity,
+        price=average_price,
+        time=lots[0].time,
+        risk=risk.quantize(Decimal('.0001'), ROUND_HALF_UP)
+    )
+
+
+class PositionBook:
+    def __init__(self, scaled=False, relief='fifo'):
+        if relief not in RELIEF_METHODS:
+            raise ValueError('unknown relief method {!r}'.format(relief))
+        if scaled and relief == 'average':
+            raise ValueError('average cost relief needs Decimal prices')
+        self.scaled = scaled
+        self.relief = relief
+        self.lots_class = RELIEF_METHODS[relief]
+        self.backend = 'scaled' if scaled else 'python'
+        # Scaled books hold prices as integers in 1e-4 units and never touch Decimal
+        self._get_opening_leg = scaled_numeric.get_opening_leg if scaled else _get_opening_leg
+        self.closed_positions = []
+        self.current_positions = {}
+        self._open_positions = {}
+        self._closed_summaries = []
+
+    def add_leg(self, leg):
+        symbol = leg['symbol']
+        if not symbol in self.current_positions:
+            self.current_positions[symbol] = self.lots_class()
         if leg['instruction'] in ['BUY', 'SELL_SHORT']:
-            quantity = leg['quantity']
-            for i in range(quantity):
-                symbol = leg['symbol']
-                instruction = leg['instruction']
-                price = leg['price']
-                time = leg['time']
-                order_id = leg['order_id']
-                activity_id = leg['activity_id']
-                share = {
-                    'symbol': symbol,
-                    'instruction': instruction,
-                    'price': price,
-                    'time': time,
-                    'order_id': order_id,
-                    'activity_id': activity_id
-                }
-                current_positions[leg['symbol']].append(share)
+            if leg['quantity']:
+                self._open_positions.pop(symbol, None)
+                self.current_positions[symbol].append(Lot(
+                    symbol=symbol,
+                    instruction=leg['instruction'],
+                    quantity=leg['quantity'],
+                    price=leg['price'],
+                    time=leg['time'],
+                    order_id=leg['order_id'],
+                    activity_id=leg.get('activity_id')
+                ))
         elif leg['instruction'] in ['SELL', 'BUY_TO_COVER']:
-            closing_quantity = leg['quantity']
-            closing_instruction = leg['instruction']
-            closing_price = leg['price']
-            closing_time = leg['time']
-            to_be_closed = []
-            for i in range(closing_quantity):
-                try:
-                    share = current_positions[leg['symbol']].popleft()
-                except IndexError:
-                    raise ValueError('closing more shares than open')
-                to_be_closed.append(share)
-            risk = sum(share['price'] for share in to_be_closed)
-            average_price = (risk / closing_quantity).quantize(Decimal('.0001'), ROUND_HALF_UP)
-            symbol = to_be_closed[0]['symbol']
-            instruction = to_be_closed[0]['instruction']
-            time = to_be_closed[0]['time']
-            opening_leg = {
-                'symbol': symbol,
-                'instruction': instruction,
-                'quantity': len(to_be_closed),
-                'price': average_price,
-                'time': time,
-                'risk': risk.quantize(Decimal('.0001'), ROUND_HALF_UP)
-            }
-            closing_leg = {
-                'symbol': symbol,
-                'instruction': closing_instruction,
-                'quantity': closing_quantity,
-                'price': closing_price,
-                'time': closing_time
-            }
-            order_ids = [share['order_id'] for share in to_be_closed]
+            self._open_positions.pop(symbol, None)
+            to_be_closed, risk = self.current_positions[symbol].relieve(leg['quantity'])
+            opening_leg = self._get_opening_leg(to_be_closed, risk)
+            closing_leg = PositionLeg(
+                symbol=opening_leg.symbol,
+                instruction=leg['instruction'],
+                quantity=leg['quantity'],
+                price=leg['price'],
+                time=leg['time']
+            )
+            order_ids = [lot.order_id for lot in to_be_closed]
             order_ids.append(leg['order_id'])
             order_ids = sorted(set(order_ids))
-            activity_ids = [share['activity_id'] for share in to_be_closed if share['activity_id']]
-            if leg['activity_id']:
+            activity_ids = [lot.activity_id for lot in to_be_closed if lot.activity_id]
+            if leg.get('activity_id'):
                 activity_ids.append(leg['activity_id'])
             activity_ids = sorted(set(activity_ids))
-            position = {
-                'opening': opening_leg,
-                'closing': closing_leg,
-                'order_ids': order_ids,
-                'activity_ids': activity_ids
-            }
-            positions.append(position)
-
-    # Add the open positions
-    for symbol, q in current_positions.items():
-        if len(q):
-            still_open = []
-            for i in range(len(q)):
-                still_open.append(q.popleft())
-            risk = sum(share['price'] for share in still_open)
-            average_price = (risk / len(still_open)).quantize(Decimal('.0001'), ROUND_HALF_UP)
-            symbol = still_open[0]['symbol']
-            instruction = still_open[0]['instruction']
-            time = still_open[0]['time']
-            opening_leg = {
-                'symbol': symbol,
-                'instruction': instruction,
-                'quantity': len(still_open),
-                'price': average_price,
-                'time': time,
-                'risk': risk.quantize(Decimal('.0001'), ROUND_HALF_UP)
-            }
-            order_ids = [share['order_id'] for share in still_open]
-            order_ids = sorted(set(order_ids))
-            activity_ids = [share['activity_id'] for share in still_open if share['activity_id']]
-            activity_ids = sorted(set(activity_ids))
-            position = {
-                'opening': opening_leg,
-                'order_ids': order_ids,
-                'activity_ids': activity_ids
-            }
-            positions.append(position)
-    return positions
+            position = Position(
+                opening=opening_leg,
+                closing=closing_leg,
+                order_ids=order_ids,
+                activity_ids=activity_ids
+            )
+            self.closed_positions.append(position)
+
+    def add_legs(self, legs):
+        for leg in legs:
+            self.add_leg(leg)
+
+    def get_open_positions(self):
+        open_positions = []
+        for symbol, lots in self.current_positions.items():
+            if not len(lots):
+                continue
+            # Only symbols touched since the last call are re-aggregated
+            position = self._open_positions.get(symbol)
+            if position is None:
+                open_lots = lots.get_lots()
+                position = Position(
+                    opening=self._get_opening_leg(open_lots, lots.get_cost()),
+                    order_ids=sorted(set(lot.order_id for lot in open_lots)),
+                    activity_ids=sorted(set(lot.activity_id for lot in open_lots if lot.activity_id))
+                )
+                self._open_positions[symbol] = position
+            open_positions.append(position)
+        return open_positions
+
+    @property
+    def positions(self):
+        return self.closed_positions + self.get_open_positions()
+
+    def get_closed_summaries(self):
+        # Closed summaries do not depend on current_date, so they are computed once per position
+        new_positions = self.closed_positions[len(self._closed_summaries):]
+        self._closed_summaries.extend(get_position_summaries(new_positions, backend=self.backend))
+        return self._closed_summaries
+
+    def get_position_summaries(self, current_date=None):
+        return self.get_closed_summaries() + get_position_summaries(self.get_open_positions(), current_date,
+                                                                    self.backend)
+
+
+# Below this many legs a pool costs more to start and feed than matching them in process
+SHARD_MIN_LEGS = 20000
+
+_shard_legs = None
+_shard_scaled = False
+_shard_relief = 'fifo'
+
+
+def _set_shard_legs(legs, scaled, relief):
+    global _shard_legs, _shard_scaled, _shard_relief
+    _shard_legs = legs
+    _shard_scaled = scaled
+    _shard_relief = relief
+
+
+def _encode_opening(opening):
+    if _shard_scaled:
+        return opening.instruction, opening.time, opening.quantity, opening.price, opening.risk
+    return opening.instruction, opening.time, opening.quantity, str(opening.price), str(opening.risk)
+
+
+def _match_shard(indexes):
+    # Legs are matched as they are, and every closing leg closes exactly one position, whose leg index restores serial
+    # order in the parent; positions travel back as strings, ints and datetimes, which pickle far faster than Decimals
+    # and records
+    book = PositionBook(_shard_scaled, _shard_relief)
+    closed_positions = book.closed_positions
+    closed = []
+    for i in indexes:
+        book.add_leg(_shard_legs[i])
+        if len(closed_positions) > len(closed):
+            position = closed_positions[-1]
+            closed.append((i, _encode_opening(position.opening), position.order_ids, position.activity_ids))
+    open_positions = [(position.opening.symbol, _encode_opening(position.opening), position.order_ids,
+                       position.activity_ids)
+                      for position in book.get_open_positions()]
+    return closed, open_positions
+
+
+def _decode_opening(symbol, encoded, scaled):
+    instruction, time, quantity, price, risk = encoded
+    if not scaled:
+        price = Decimal(price)
+        risk = Decimal(risk)
+    return PositionLeg(symbol=symbol, instruction=instruction, quantity=quantity, price=price, time=time, risk=risk)
+
+
+def _get_shards(legs, processes):
+    symbol_indexes = {}
+    for i, leg in enumerate(legs):
+        symbol = leg['symbol']
+        indexes = symbol_indexes.get(symbol)
+        if indexes is None:
+            indexes = symbol_indexes[symbol] = []
+        indexes.append(i)
+    # Largest symbols first onto the lightest shard keeps the workers evenly loaded
+    shards = [[] for _ in range(min(processes, len(symbol_indexes)))]
+    for indexes in sorted(symbol_indexes.values(), key=len, reverse=True):
+        min(shards, key=len).extend(indexes)
+    for indexes in shards:
+        indexes.sort()
+    return list(symbol_indexes), shards
+
+
+@instrumented('get_positions')
+def get_positions(legs, processes=1, scaled=False, relief='fifo'):
+    shards = ()
+    if processes != 1:
+        # Sequences are passed on as they are, so a LegFile reaches the workers as its path and they map the same pages
+        if not hasattr(legs, '__getitem__') or not hasattr(legs, '__len__'):
+            legs = list(legs)
+        if len(legs) >= SHARD_MIN_LEGS:
+            symbols, shards = _get_shards(legs, processes or os.cpu_count() or 1)
+    if len(shards) <= 1:
+        book = PositionBook(scaled, relief)
+        book.add_legs(legs)
+        return book.positions
+    from concurrent.futures import ProcessPoolExecutor
 
+    with ProcessPoolExecutor(max_workers=len(shards), initializer=_set_shard_legs,
+                             initargs=(legs, scaled, relief)) as executor:
+        results = list(executor.map(_match_shard, shards))
+    # Symbols never interact, so serial order is restored from the index of each closing leg and, for open
+    # positions, the order in which symbols first appeared
+    positions = []
+    for closing_index, opening, order_ids, activity_ids in heapq.merge(*[closed for closed, _ in results]):
+        leg = legs[closing_index]
+        opening_leg = _decode_opening(leg['symbol'], opening, scaled)
+        positions.append(Position(
+            opening=opening_leg,
+            closing=PositionLeg(
+                symbol=opening_leg.symbol,
+                instruction=leg['instruction'],
+                quantity=opening_leg.quantity,
+                price=leg['price'],
+                time=leg['time']
+            ),
+            order_ids=order_ids,
+            activity_ids=activity_ids
+        ))
+    open_positions = [Position(opening=_decode_opening(symbol, opening, scaled), order_ids=order_ids,
+                               activity_ids=activity_ids)
+                      for _, open_positions in results for symbol, opening, order_ids, activity_ids in open_positions]
+    symbol_order = {symbol: i for i, symbol in enumerate(symbols)}
+    open_positions.sort(key=lambda position: symbol_order[position.opening.symbol])
+    return positions + open_positions
+
+
+def get_closing_values(opening, closing):
+    quantity = opening['quantity']
+    size = quantity * closing['price']
+    exit_price = size / quantity
+    rounded_exit_price = exit_price.quantize(Decimal('0.0001'), rounding=ROUND_HALF_UP)
+    profit_percentage = ((exit_price / opening['price']) - 1) * 100
+    profit_percentage = profit_percentage.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    profit = size - opening['risk']
+    rounded_profit = profit.quantize(Decimal('0.0001'), rounding=ROUND_HALF_UP)
+    if 'BUY_TO_COVER' in closing['instruction']:
+        rounded_profit = rounded_profit * -1
+        profit_percentage = profit_percentage * -1
+    return rounded_exit_price, rounded_profit, profit_percentage
+
+
+class LazyPositionSummary(Mapping):
+    # Reads straight from the position, P&L is only computed when one of its fields is first looked up
+    __slots__ = ('position', 'current_date', '_closing_values')
+    fields = PositionSummary.fields
+
+    def __init__(self, position, current_date):
+        self.position = position
+        self.current_date = current_date
+        self._closing_values = None
+
+    def __getitem__(self, key):
+        getter = _LAZY_FIELDS.get(key)
+        if getter is None:
+            raise KeyError(key)
+        return getter(self)
+
+    def __iter__(self):
+        return iter(self.fields)
+
+    def __len__(self):
+        return len(self.fields)
+
+    def __repr__(self):
+        return '{}({!r})'.format(type(self).__name__, self.position)
+
+    def get_closing_value(self, index):
+        closing = self.position.get('closing')
+        if closing is None:
+            return None
+        if self._closing_values is None:
+            self._closing_values = get_closing_values(self.position['opening'], closing)
+        return self._closing_values[index]
+
+    def get_exit_date(self):
+        closing = self.position.get('closing')
+        return None if closing is None else closing['time'].date()
+
+    def get_days(self):
+        exit_date = self.get_exit_date()
+        return ((self.current_date if exit_date is None else exit_date)
+                - self.position['opening']['time'].date()).days
 
-def get_position_summaries(positions, current_date=None):
+
+_LAZY_FIELDS = {
+    'symbol': lambda summary: summary.position['opening']['symbol'],
+    'risk': lambda summary: summary.position['opening']['risk'],
+    'entry_date': lambda summary: summary.position['opening']['time'].date(),
+    'average_price': lambda summary: summary.position['opening']['price'],
+    'exit_price': lambda summary: summary.get_closing_value(0),
+    'exit_date': LazyPositionSummary.get_exit_date,
+    'days': LazyPositionSummary.get_days,
+    'quantity': lambda summary: summary.position['opening']['quantity'],
+    'direction': lambda summary: 'Long' if summary.position['opening']['instruction'] == 'BUY' else 'Short',
+    'profit': lambda summary: summary.get_closing_value(1),
+    'profit_percentage': lambda summary: summary.get_closing_value(2),
+    'number_legs': lambda summary: len(set(summary.position['order_ids'])),
+    'order_ids': lambda summary: summary.position['order_ids'],
+    'activity_ids': lambda summary: summary.position['activity_ids'],
+}
+
+
+def iter_position_summaries(positions, current_date=None, backend='python', lazy=False):
+    if lazy and backend != 'python':
+        raise ValueError('lazy summaries need the python backend')
+    if backend == 'numpy':
+        from tradingbutler.vectorized import PositionColumns
+        yield from PositionColumns(positions, current_date)
+        return
+    if backend == 'scaled':
+        yield from scaled_numeric.iter_position_summaries(positions, current_date)
+        return
+    if backend != 'python':
+        raise ValueError('unknown backend {!r}'.format(backend))
     if current_date is None:
         current_date = datetime.datetime.now().date()
-    position_summaries = []
+    if lazy:
+        for position in positions:
+            yield LazyPositionSummary(position, current_date)
+        return
     for position in positions:
-        position_summary = {}
-        position_summaries.append(position_summary)
         order_ids = position['order_ids']
         activity_ids = position['activity_ids']
         number_legs = len(set(order_ids))
-        risk = position['opening']['risk']
-        quantity = position['opening']['quantity']
-        price = position['opening']['price']
-        symbol = position['opening']['symbol']
-        direction = 'Long' if position['opening']['instruction'] == 'BUY' else 'Short'
-        entry_date = position['opening']['time'].date()
-        if 'closing' in position:
-            size = quantity * position['closing']['price']
-            exit_price = size / quantity
-            rounded_exit_price = exit_price.quantize(Decimal('0.0001'), rounding=ROUND_HALF_UP)
-            profit_percentage = ((exit_price / price) - 1) * 100
-            profit_percentage = profit_percentage.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-            profit = size - risk
-            rounded_profit = profit.quantize(Decimal('0.0001'), rounding=ROUND_HALF_UP)
-            exit_date = position['closing']['time'].date()
+        opening = position['opening']
+        closing = position.get('closing')
+        risk = opening['risk']
+        quantity = opening['quantity']
+        price = opening['price']
+        symbol = opening['symbol']
+        direction = 'Long' if opening['instruction'] == 'BUY' else 'Short'
+        entry_date = opening['time'].date()
+        if closing is not None:
+            rounded_exit_price, rounded_profit, profit_percentage = get_closing_values(opening, closing)
+            exit_date = closing['time'].date()
             days = (exit_date - entry_date).days
-            if 'BUY_TO_COVER' in position['closing']['instruction']:
-                rounded_profit = rounded_profit * -1
-                profit_percentage = profit_percentage * -1
         else:
             rounded_exit_price = None
             exit_date = None
             rounded_profit = None
             profit_percentage = None
             days = (current_date - entry_date).days
-        position_summary.update({
-            'symbol': symbol,
-            'risk': risk,
-            'entry_date': entry_date,
-            'average_price': price,
-            'exit_price': rounded_exit_price,
-            'exit_date': exit_date,
-            'days': days,
-            'quantity': quantity,
-            'direction': direction,
-            'profit': rounded_profit,
-            'profit_percentage': profit_percentage,
-            'number_legs': number_legs,
-            'order_ids': order_ids,
-            'activity_ids': activity_ids
-        })
-    return position_summaries
-
-
-def write_output(position_summaries, keys=None, template_file='template.html', output_file='output.html'):
-    if keys is None:
-        keys = ['symbol', 'direction', 'entry_date', 'average_price', 'exit_price', 'exit_date', 'days', 'quantity',
+        yield PositionSummary(
+            symbol=symbol,
+            risk=risk,
+            entry_date=entry_date,
+            average_price=price,
+            exit_price=rounded_exit_price,
+            exit_date=exit_date,
+            days=days,
+            quantity=quantity,
+            direction=direction,
+            profit=rounded_profit,
+            profit_percentage=profit_percentage,
+            number_legs=number_legs,
+            order_ids=order_ids,
+            activity_ids=activity_ids
+        )
+
+
+@instrumented('get_position_summaries')
+def get_position_summaries(positions, current_date=None, backend='python'):
+    return list(iter_position_summaries(positions, current_date, backend))
+
+
+DEFAULT_KEYS = ['symbol', 'direction', 'entry_date', 'average_price', 'exit_price', 'exit_date', 'days', 'quantity',
                 'risk', 'profit_percentage', 'profit', 'number_legs']
-    template = env.get_template(template_file)
-    output = template.render(position_summaries=position_summaries, keys=keys)
-    with open(output_file, 'w') as f:
-        f.write(output)
+
+
+@instrumented('write_output')
+def write_output(position_summaries, keys=None, template_file='template.html', output_file='output.html',
+                 buffer_size=100):
+    if keys is None:
+        keys = DEFAULT_KEYS
+    render_template(template_file, output_file, buffer_size, position_summaries=position_summaries, keys=keys)
+
+
+def render_template(template_file, output_file, buffer_size=100, **context):
+    template = get_environment().get_template(template_file)
+    # Render incrementally so context values may be generators and rows reach the file as they are produced
+    stream = template.stream(**context)
+    if buffer_size > 1:
+        stream.enable_buffering(buffer_size)
+    if hasattr(output_file, 'write'):
+        stream.dump(output_file)
+    else:
+        with open(output_file, 'w') as f:
+            stream.dump(f)
@@ -0,0 +1,97 @@
+import datetime
+import json
+import random
+
+DEFAULT_SYMBOLS = ('AAPL', 'AMZN', 'GE', 'META', 'MSFT', 'NVDA', 'T', 'TSLA')
+
+
+def iter_orders(orders=1000, symbols=DEFAULT_SYMBOLS, fills_per_order=(1, 3), shares=(1, 500), short_ratio=0.3,
+                close_ratio=0.45, cancel_ratio=0.05, start=datetime.datetime(2020, 1, 2, 14, 30), seed=0):
+    # Orders are yielded oldest first and a close never exceeds the open quantity of its symbol
+    rng = random.Random(seed)
+    if isinstance(symbols, int):
+        symbols = ['SYM{}'.format(i) for i in range(symbols)]
+    prices = {symbol: rng.uniform(5, 500) for symbol in symbols}
+    open_positions = {}
+    time = start
+    activity_id = 0
+    for order_id in range(1, orders + 1):
+        time += datetime.timedelta(seconds=rng.randint(1, 3600))
+        symbol = rng.choice(symbols)
+        prices[symbol] = max(0.01, prices[symbol] * rng.uniform(0.97, 1.03))
+        instruction, quantity = _get_order(rng, open_positions.get(symbol), shares, short_ratio, close_ratio)
+        order = {
+            'orderId': order_id,
+            'enteredTime': _format_time(time),
+            'orderLegCollection': [{'instruction': instruction, 'instrument': {'symbol': symbol}}],
+        }
+        if rng.random() < cancel_ratio:
+            order['status'] = 'CANCELED'
+            yield order
+            continue
+        order['status'] = 'FILLED'
+        direction, open_quantity = open_positions.get(symbol, (None, 0))
+        if instruction in ('BUY', 'SELL_SHORT'):
+            open_positions[symbol] = (instruction, open_quantity + quantity)
+        elif open_quantity == quantity:
+            del open_positions[symbol]
+        else:
+            open_positions[symbol] = (direction, open_quantity - quantity)
+        activities = []
+        for fill in _split(rng, quantity, rng.randint(*fills_per_order)):
+            activity_id += 1
+            time += datetime.timedelta(seconds=rng.randint(0, 5))
+            activities.append({
+                'activityType': 'EXECUTION',
+                'activityId': activity_id,
+                'executionLegs': [{
+                    'legId': 1,
+                    'quantity': float(fill),
+                    'price': round(prices[symbol] * rng.uniform(0.999, 1.001), 2),
+                    'time': _format_time(time),
+                }],
+            })
+        # TDA lists the newest activity first
+        order['orderActivityCollection'] = activities[::-1]
+        yield order
+
+
+def _get_order(rng, position, shares, short_ratio, close_ratio):
+    if position is not None and rng.random() < close_ratio:
+        direction, open_quantity = position
+        quantity = min(open_quantity, rng.randint(*shares))
+        if rng.random() < 0.5:
+            quantity = open_quantity
+        return ('SELL' if direction == 'BUY' else 'BUY_TO_COVER'), quantity
+    if position is not None:
+        return position[0], rng.randint(*shares)
+    return ('SELL_SHORT' if rng.random() < short_ratio else 'BUY'), rng.randint(*shares)
+
+
+def _split(rng, quantity, parts):
+    parts = max(1, min(parts, quantity))
+    cuts = sorted(rng.sample(range(1, quantity), parts - 1)) if parts > 1 else []
+    return [end - start for start, end in zip([0] + cuts, cuts + [quantity])]
+
+
+def _format_time(time):
+    return time.strftime('%Y-%m-%dT%H:%M:%S+0000')
+
+
+def generate_orders(descending=False, **kwargs):
+    orders = list(iter_orders(**kwargs))
+    return orders if descending else orders[::-1]
+
+
+def write_orders(path, descending=False, **kwargs):
+    # Orders are serialized one at a time; newest-first exports only keep the encoded strings in memory
+    encoded = (json.dumps(order, separators=(',', ':')) for order in iter_orders(**kwargs))
+    if not descending:
+        encoded = reversed(list(encoded))
+    with open(path, 'w') as f:
+        f.write('[')
+        for i, order in enumerate(encoded):
+            if i:
+                f.write(',\n')
+            f.write(order)
+        f.write(']')
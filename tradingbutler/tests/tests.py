@@ -1,11 +1,57 @@
+import collections
+import csv
 import datetime
+import io
+import json
+import os
+import pickle
+import re
+import subprocess
+import sys
 from decimal import Decimal
 from decimal import ROUND_HALF_UP
 
 import pytest
+from dateutil.parser import parse
 
+from tradingbutler.aggregate import EXPORT_KEYS
+from tradingbutler.aggregate import get_aggregates
+from tradingbutler.aggregate import iter_aggregate_rows
+from tradingbutler.aggregate import write_aggregates
+from tradingbutler.bench import find_regressions
+from tradingbutler.bench import run_benchmark
+from tradingbutler.cli import main
+from tradingbutler.dedup import SeenKeys
+from tradingbutler.dedup import iter_unique_legs
+from tradingbutler.export import write_csv
+from tradingbutler.export import write_jsonl
+from tradingbutler.index import PositionIndex
+from tradingbutler.instrumentation import PipelineStats
+from tradingbutler.instrumentation import get_active_stats
+from tradingbutler.legfile import LegFile
+from tradingbutler.legfile import write_legs
+from tradingbutler.marks import MarkToMarket
+from tradingbutler.marks import PriceSnapshot
+from tradingbutler.marks import iter_marked_summaries
+from tradingbutler.records import Leg
+from tradingbutler.records import Position
+from tradingbutler.records import PositionSummary
+from tradingbutler.scaled import scale_legs
+from tradingbutler.store import TradeStore
+from tradingbutler.summary import PositionBook
+from tradingbutler.summary import TdaTradeImporter
+from tradingbutler.summary import env
+from tradingbutler.summary import get_environment
 from tradingbutler.summary import get_position_summaries
 from tradingbutler.summary import get_positions
+from tradingbutler.summary import import_paths
+from tradingbutler.summary import iter_merged_paths
+from tradingbutler.summary import iter_position_summaries
+from tradingbutler.summary import parse_time
+from tradingbutler.summary import write_output
+from tradingbutler.synthetic import generate_orders
+from tradingbutler.synthetic import write_orders
+from tradingbutler.watch import ReportWatcher
 
 legs = [
     {
@@ -50,6 +96,46 @@ legs = [
     }
 ]
 
+tda_orders = [
+    {
+        'orderId': 3,
+        'orderLegCollection': [{'instruction': 'SELL', 'instrument': {'symbol': 'META'}}],
+        'orderActivityCollection': [
+            {
+                'activityId': 32,
+                'executionLegs': [
+                    {'quantity': 4.0, 'price': 232.11, 'time': '2022-10-20T14:31:02+0000'}
+                ]
+            },
+            {
+                'activityId': 31,
+                'executionLegs': [
+                    {'quantity': 2.0, 'price': 232.1, 'time': '2022-10-20T14:31:01+0000'},
+                    {'quantity': 1.0, 'price': 232.12, 'time': '2022-10-20T14:31:01+0000'}
+                ]
+            }
+        ]
+    },
+    {
+        'orderId': 2,
+        'orderLegCollection': [{'instruction': 'BUY', 'instrument': {'symbol': 'META'}}],
+        'status': 'CANCELED'
+    },
+    {
+        'orderId': 1,
+        'orderLegCollection': [{'instruction': 'BUY', 'instrument': {'symbol': 'META'}}],
+        'orderActivityCollection': [
+            {
+                'activityId': 11,
+                'executionLegs': [
+                    {'quantity': 10.0, 'price': 241.34, 'time': '2022-10-13T13:30:00+0000'}
+                ]
+            }
+        ],
+        'tag': 'caf\u00e9 \u2615'
+    }
+]
+
 
 def test_get_positions():
     positions = get_positions(legs=legs)
@@ -580,3 +666,946 @@ def test_closing_more_shares_than_open_fails():
     with pytest.raises(ValueError) as excinfo:
         get_positions(legs=data)
     assert excinfo.value.args[0] == 'closing more shares than open'
+
+
+def test_large_fills_are_matched_by_lot():
+    data = [
+        {
+            'symbol': 'GE',
+            'instruction': 'BUY',
+            'quantity': 10000000,
+            'price': Decimal('72.01'),
+            'time': datetime.datetime(2022, 9, 20),
+            'order_id': 1,
+            'activity_id': 11
+        },
+        {
+            'symbol': 'GE',
+            'instruction': 'BUY',
+            'quantity': 5000000,
+            'price': Decimal('54.21'),
+            'time': datetime.datetime(2022, 10, 4),
+            'order_id': 2,
+            'activity_id': 12
+        },
+        {
+            'symbol': 'GE',
+            'instruction': 'SELL',
+            'quantity': 12000000,
+            'price': Decimal('65.14'),
+            'time': datetime.datetime(2022, 10, 17),
+            'order_id': 3,
+            'activity_id': 13
+        }
+    ]
+    positions = get_positions(legs=data)
+    expected = [
+        {
+            'closing':
+                {
+                    'instruction': 'SELL',
+                    'price': Decimal('65.14'),
+                    'quantity': 12000000,
+                    'symbol': 'GE',
+                    'time': datetime.datetime(2022, 10, 17)
+                },
+            'opening':
+                {
+                    'instruction': 'BUY',
+                    'price': Decimal('69.0433'),
+                    'quantity': 12000000,
+                    'risk': Decimal('828520000.0000'),
+                    'symbol': 'GE',
+                    'time': datetime.datetime(2022, 9, 20)
+                },
+            'order_ids': [1, 2, 3],
+            'activity_ids': [11, 12, 13]
+        },
+        {
+            'opening':
+                {
+                    'instruction': 'BUY',
+                    'price': Decimal('54.2100'),
+                    'quantity': 3000000,
+                    'risk': Decimal('162630000.0000'),
+                    'symbol': 'GE',
+                    'time': datetime.datetime(2022, 10, 4)
+                },
+            'order_ids': [2],
+            'activity_ids': [12]
+        }
+    ]
+    assert positions == expected
+
+
+@pytest.mark.parametrize('descending', [False, True])
+@pytest.mark.parametrize('chunk_size', [1, 7, 65536])
+def test_iter_path_matches_from_path(tmp_path, descending, chunk_size):
+    path = tmp_path / 'orders.json'
+    path.write_text(json.dumps(tda_orders, indent=2, ensure_ascii=False), encoding='utf-8')
+    expected = TdaTradeImporter(path.read_text(encoding='utf-8'), descending=descending).legs
+    legs = TdaTradeImporter.iter_path(str(path), descending=descending, chunk_size=chunk_size)
+    assert not isinstance(legs, list)
+    assert list(legs) == expected
+    assert get_positions(TdaTradeImporter.iter_path(str(path), chunk_size=chunk_size)) == get_positions(
+        TdaTradeImporter(path.read_text(encoding='utf-8')).legs)
+
+
+def test_iter_path_single_order(tmp_path):
+    path = tmp_path / 'order.json'
+    path.write_text(json.dumps(tda_orders[0]))
+    legs = list(TdaTradeImporter.iter_path(str(path), chunk_size=5))
+    assert [leg['activity_id'] for leg in legs] == [31, 31, 32]
+    assert legs[1]['price'] == Decimal('232.12')
+
+
+def test_iter_path_rejects_malformed_json(tmp_path):
+    path = tmp_path / 'orders.json'
+    path.write_text(json.dumps(tda_orders)[:-3])
+    with pytest.raises(ValueError):
+        list(TdaTradeImporter.iter_path(str(path), chunk_size=16))
+
+
+@pytest.mark.parametrize('value', [
+    '2022-10-20T14:31:02+0000',
+    '2022-10-20T14:31:02-0500',
+    '2022-10-20T14:31:02+0130',
+    '2022-10-20T14:31:02.125+0000',
+    '2022-10-20 14:31',
+])
+def test_parse_time_matches_dateutil(value):
+    assert repr(parse_time(value)) == repr(parse(value))
+
+
+def test_parse_time_rejects_invalid_dates():
+    with pytest.raises(ValueError):
+        parse_time('2022-02-30T14:31:02+0000')
+
+
+def test_position_book_matches_get_positions():
+    book = PositionBook()
+    for leg in legs[:3]:
+        book.add_leg(leg)
+    assert len(book.positions) == 2
+    assert book.get_position_summaries(datetime.date(2022, 11, 1))[1]['days'] == 52
+    book.add_legs(legs[3:])
+    assert book.positions == get_positions(legs)
+    current_date = datetime.date(2022, 11, 1)
+    assert book.get_position_summaries(current_date) == get_position_summaries(get_positions(legs), current_date)
+
+
+def test_position_book_updates_open_positions_in_place():
+    book = PositionBook()
+    book.add_legs([
+        {
+            'symbol': 'GE',
+            'instruction': 'BUY',
+            'quantity': 12,
+            'price': Decimal('72.01'),
+            'time': datetime.datetime(2022, 9, 20),
+            'order_id': 1
+        },
+        {
+            'symbol': 'META',
+            'instruction': 'SELL_SHORT',
+            'quantity': 3,
+            'price': Decimal('241.34'),
+            'time': datetime.datetime(2022, 9, 21),
+            'order_id': 2
+        }
+    ])
+    assert [position['opening']['quantity'] for position in book.positions] == [12, 3]
+    book.add_leg({
+        'symbol': 'GE',
+        'instruction': 'SELL',
+        'quantity': 5,
+        'price': Decimal('65.14'),
+        'time': datetime.datetime(2022, 10, 17),
+        'order_id': 3
+    })
+    assert len(book.closed_positions) == 1
+    assert [position['opening']['quantity'] for position in book.positions] == [5, 7, 3]
+    assert book.positions[1]['opening']['risk'] == Decimal('504.0700')
+
+
+def test_trade_store_ingests_incrementally(tmp_path):
+    export_path = tmp_path / 'export.json'
+    write_orders(str(export_path), orders=300, symbols=6, seed=4)
+    legs = TdaTradeImporter.from_path(str(export_path)).legs
+    expected = get_positions(legs)
+    with TradeStore(str(tmp_path / 'trades.db')) as store:
+        assert store.get_high_water_mark() is None
+        assert store.ingest(legs[:200]) == 200
+        assert store.get_positions() == get_positions(legs[:200])
+        # A later export repeats everything seen so far
+        assert store.ingest(legs) == len(legs) - 200
+        assert store.ingest(legs) == 0
+    with TradeStore(str(tmp_path / 'trades.db')) as store:
+        positions = store.get_positions()
+        assert positions == expected
+        assert [str(position['opening']['risk']) for position in positions] == \
+            [str(position['opening']['risk']) for position in expected]
+        assert store.get_legs() == legs
+        assert store.get_legs('SYM1') == [leg for leg in legs if leg['symbol'] == 'SYM1']
+        end = legs[150]['time']
+        assert store.get_positions('SYM2', end=end) == [
+            position for position in expected if position['opening']['symbol'] == 'SYM2'
+            and position.get('closing') and position['closing']['time'] < end]
+
+
+def test_trade_store_ingests_earlier_legs():
+    def get_legs(symbol, order_id, days):
+        return [Leg(symbol=symbol, instruction=instruction, quantity=5, price=Decimal(price),
+                    time=datetime.datetime(2023, 1, day, tzinfo=datetime.timezone.utc), order_id=order_id + i,
+                    activity_id=(order_id + i) * 10, execution_index=0)
+                for i, (instruction, price, day) in enumerate(zip(['BUY', 'SELL'], ['10', '12'], days))]
+
+    first = get_legs('A', 1, [10, 20])
+    second = get_legs('B', 3, [5, 15])
+    with TradeStore() as store:
+        assert store.ingest(first) == 2
+        # A second account's legs all predate the first one's, the store rebuilds instead of dropping them
+        assert store.ingest(second) == 2
+        assert store.ingest(first + second) == 0
+        legs = sorted(first + second, key=lambda leg: leg['time'])
+        assert store.get_legs() == legs
+        assert store.get_positions() == get_positions(legs)
+        with pytest.raises(ValueError):
+            store.ingest([second[1].replace(order_id=9, activity_id=90, time=datetime.datetime(
+                2023, 1, 1, tzinfo=datetime.timezone.utc))])
+        assert store.get_legs() == legs
+        assert store.get_positions() == get_positions(legs)
+
+
+def test_leg_file_round_trip(tmp_path, monkeypatch):
+    export_path = tmp_path / 'export.json'
+    write_orders(str(export_path), orders=200, symbols=4, seed=2)
+    expected = TdaTradeImporter.from_path(str(export_path)).legs
+    expected += [
+        {'symbol': 'T', 'instruction': 'BUY', 'quantity': 3, 'price': Decimal('17.123456'),
+         'time': datetime.datetime(2022, 3, 1, 9, 30), 'order_id': 9},
+        Leg(quantity=3, price=Decimal('17.5'), time=parse_time('2022-03-02T09:30:00-0400'), instruction='SELL',
+            symbol='T', order_id=10, activity_id=101),
+    ]
+    path = tmp_path / 'legs.tblegs'
+    write_legs(str(path), expected)
+    with LegFile(str(path)) as legs:
+        assert len(legs) == len(expected)
+        assert legs.columns['quantity'].tolist() == [leg['quantity'] for leg in expected]
+        assert [str(leg['price']) for leg in legs] == [str(leg['price']) for leg in expected]
+        assert [leg['time'].isoformat() for leg in legs] == [leg['time'].isoformat() for leg in expected]
+        assert [dict(leg) for leg in legs][:-2] == [dict(leg) for leg in expected][:-2]
+        assert legs[-2]['activity_id'] is None
+        assert legs[-1] == expected[-1]
+        assert legs[-3:] == [legs[i] for i in range(len(legs) - 3, len(legs))]
+        assert legs[::50] == list(legs)[::50]
+        assert get_positions(legs) == get_positions(expected)
+        monkeypatch.setattr('tradingbutler.summary.SHARD_MIN_LEGS', 0)
+        assert get_positions(legs, processes=2) == get_positions(expected)
+        with pickle.loads(pickle.dumps(legs)) as reopened:
+            assert reopened[3] == legs[3]
+
+    (tmp_path / 'bad.tblegs').write_bytes(b'not a leg file')
+    with pytest.raises(ValueError):
+        LegFile(str(tmp_path / 'bad.tblegs'))
+
+
+@pytest.mark.parametrize('processes', [2, 3])
+def test_sharded_matching_matches_serial(tmp_path, monkeypatch, processes):
+    export_path = tmp_path / 'export.json'
+    write_orders(str(export_path), orders=300, symbols=7, seed=5)
+    legs = TdaTradeImporter.from_path(str(export_path)).legs
+    expected = get_positions(legs)
+    with monkeypatch.context() as m:
+        # Too few legs to be worth starting a pool for
+        m.setattr('concurrent.futures.ProcessPoolExecutor', None)
+        assert get_positions(iter(legs), processes=processes) == expected
+    monkeypatch.setattr('tradingbutler.summary.SHARD_MIN_LEGS', 0)
+    positions = get_positions(iter(legs), processes=processes)
+    assert [dict(position) for position in positions] == [dict(position) for position in expected]
+    assert [str(position['opening']['price']) for position in positions] == \
+        [str(position['opening']['price']) for position in expected]
+
+
+relief_legs = [
+    Leg(symbol='GE', instruction='BUY', quantity=10, price=Decimal('10'), time=datetime.datetime(2022, 9, 1),
+        order_id=1),
+    Leg(symbol='GE', instruction='BUY', quantity=10, price=Decimal('30'), time=datetime.datetime(2022, 9, 2),
+        order_id=2),
+    Leg(symbol='GE', instruction='BUY', quantity=10, price=Decimal('20'), time=datetime.datetime(2022, 9, 3),
+        order_id=3),
+    Leg(symbol='GE', instruction='SELL', quantity=15, price=Decimal('25'), time=datetime.datetime(2022, 9, 4),
+        order_id=4),
+]
+
+
+@pytest.mark.parametrize('relief, closed_risk, closed_date, closed_order_ids, open_risk, open_order_ids', [
+    ('fifo', Decimal('250.0000'), datetime.datetime(2022, 9, 1), [1, 2, 4], Decimal('350.0000'), [2, 3]),
+    ('lifo', Decimal('350.0000'), datetime.datetime(2022, 9, 2), [2, 3, 4], Decimal('250.0000'), [1, 2]),
+    ('hifo', Decimal('400.0000'), datetime.datetime(2022, 9, 2), [2, 3, 4], Decimal('200.0000'), [1, 3]),
+    ('average', Decimal('300.0000'), datetime.datetime(2022, 9, 1), [1, 2, 4], Decimal('300.0000'), [2, 3]),
+])
+def test_relief_methods(relief, closed_risk, closed_date, closed_order_ids, open_risk, open_order_ids):
+    closed, open_position = get_positions(relief_legs, relief=relief)
+    assert closed['opening']['quantity'] == 15
+    assert closed['opening']['risk'] == closed_risk
+    assert closed['opening']['time'] == closed_date
+    assert closed['order_ids'] == closed_order_ids
+    assert open_position['opening']['quantity'] == 15
+    assert open_position['opening']['risk'] == open_risk
+    assert open_position['order_ids'] == open_order_ids
+    with pytest.raises(ValueError) as excinfo:
+        get_positions(relief_legs + [relief_legs[-1].replace(quantity=16)], relief=relief)
+    assert excinfo.value.args[0] == 'closing more shares than open'
+
+
+def test_average_cost_is_rounded_once():
+    time = datetime.datetime(2022, 9, 1)
+    data = [
+        Leg(symbol='C', instruction='BUY', quantity=1, price=Decimal('10.0005'), time=time, order_id=1),
+        Leg(symbol='C', instruction='BUY', quantity=5, price=Decimal('10'), time=time, order_id=2),
+        Leg(symbol='C', instruction='SELL', quantity=3, price=Decimal('11'), time=time, order_id=3),
+    ]
+    # 60.0005 * 3 / 6 is exactly 30.00025, which a rounded per-share average of 10.0000833... turns into 30.0002
+    closed, open_position = get_positions(data, relief='average')
+    assert closed['opening']['risk'] == Decimal('30.0003')
+    assert open_position['opening']['risk'] == Decimal('30.0003')
+    with TradeStore(relief='average') as store:
+        store.ingest(data[:2])
+        store.ingest(data[2:])
+        assert store.get_positions() == [closed, open_position]
+
+
+@pytest.mark.parametrize('relief', ['fifo', 'lifo', 'hifo', 'average'])
+def test_rejected_closing_keeps_open_lots(relief):
+    book = PositionBook(relief=relief)
+    book.add_legs(relief_legs[:2])
+    with pytest.raises(ValueError):
+        book.add_leg(relief_legs[-1].replace(quantity=21))
+    assert [position['opening']['quantity'] for position in book.positions] == [20]
+    book.add_leg(relief_legs[-1])
+    assert [position['opening']['quantity'] for position in book.positions] == [15, 5]
+
+
+@pytest.mark.parametrize('relief', ['lifo', 'hifo', 'average'])
+def test_relief_methods_shard_and_store(tmp_path, monkeypatch, relief):
+    export_path = tmp_path / 'export.json'
+    write_orders(str(export_path), orders=300, symbols=5, seed=6)
+    legs = TdaTradeImporter.from_path(str(export_path)).legs
+    expected = get_positions(legs, relief=relief)
+    assert expected != get_positions(legs)
+    monkeypatch.setattr('tradingbutler.summary.SHARD_MIN_LEGS', 0)
+    assert get_positions(legs, processes=2, relief=relief) == expected
+    with TradeStore(str(tmp_path / 'trades.db'), relief=relief) as store:
+        store.ingest(legs[:200])
+        store.ingest(legs)
+        assert store.get_positions() == expected
+    with pytest.raises(ValueError):
+        TradeStore(str(tmp_path / 'trades.db'))
+
+
+def test_from_path_cache(tmp_path, monkeypatch):
+    path = tmp_path / 'orders.json'
+    path.write_text(json.dumps(tda_orders))
+    cache_dir = tmp_path / 'cache'
+    expected = TdaTradeImporter.from_path(str(path)).legs
+    assert TdaTradeImporter.from_path(str(path), cache_dir=str(cache_dir)).legs == expected
+    assert len(list(cache_dir.iterdir())) == 1
+
+    def fail(*args, **kwargs):
+        raise AssertionError('export was parsed again')
+
+    with monkeypatch.context() as m:
+        m.setattr(json, 'loads', fail)
+        importer = TdaTradeImporter.from_path(str(path), cache_dir=str(cache_dir))
+    assert importer.legs == expected
+    assert repr(importer.legs[0]['time']) == repr(expected[0]['time'])
+
+    os.utime(str(path), ns=(0, 0))
+    with monkeypatch.context() as m:
+        m.setattr(json, 'loads', fail)
+        assert TdaTradeImporter.from_path(str(path), cache_dir=str(cache_dir)).legs == expected
+
+    path.write_text(json.dumps(tda_orders[2:]))
+    assert len(TdaTradeImporter.from_path(str(path), cache_dir=str(cache_dir)).legs) == 1
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_import_paths(tmp_path, processes):
+    (tmp_path / 'a.json').write_text(json.dumps(tda_orders[2]))
+    (tmp_path / 'b.json').write_text(json.dumps(tda_orders[:2]))
+    legs = import_paths(str(tmp_path / '*.json'), processes=processes)
+    assert [(leg['order_id'], leg['activity_id']) for leg in legs] == [(1, 11), (3, 31), (3, 31), (3, 32)]
+    assert legs == TdaTradeImporter(json.dumps(tda_orders)).legs
+    assert import_paths([str(tmp_path / 'b.json'), str(tmp_path / 'a.json')], processes=processes) == legs
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_import_paths_stats(tmp_path, processes):
+    (tmp_path / 'a.json').write_text(json.dumps(tda_orders[2]))
+    (tmp_path / 'b.json').write_text(json.dumps(tda_orders[:2]))
+    output = io.StringIO()
+    with PipelineStats(output=output) as stats:
+        import_paths(str(tmp_path / '*.json'), processes=processes)
+    # Stages run in the workers are recorded by the parent too
+    assert list(stats.stages) == ['json_decode', 'get_legs', 'import']
+    assert stats['json_decode'].calls == 2
+    assert stats['get_legs'].rows == 4
+    assert stats['import'].calls == 1
+    assert stats['import'].rows == 4
+    assert [json.loads(line)['stage'] for line in output.getvalue().splitlines()][-1] == 'import'
+
+
+def test_import_paths_drops_overlapping_executions(tmp_path):
+    orders = generate_orders(orders=300, symbols=5, seed=6)
+    # Exports list the newest orders first, the two files share 100 orders
+    (tmp_path / 'new.json').write_text(json.dumps(orders[:200]))
+    (tmp_path / 'old.json').write_text(json.dumps(orders[100:]))
+    legs = import_paths(str(tmp_path / '*.json'), processes=1)
+    assert legs == TdaTradeImporter(json.dumps(orders)).legs
+    assert get_positions(legs) == get_positions(TdaTradeImporter(json.dumps(orders)).legs)
+    assert len(import_paths(str(tmp_path / '*.json'), processes=1, deduplicate=False)) > len(legs)
+    assert [leg['execution_index'] for leg in TdaTradeImporter(json.dumps(tda_orders)).legs] == [0, 0, 1, 0]
+
+
+def test_iter_merged_paths_matches_import_paths(tmp_path):
+    orders = generate_orders(orders=300, symbols=5, seed=6)
+    (tmp_path / 'new.json').write_text(json.dumps(orders[:200]))
+    (tmp_path / 'old.json').write_text(json.dumps(orders[100:]))
+    # A second account trades other symbols under its own ids
+    other = generate_orders(orders=200, symbols=('X', 'Y'), seed=7)
+    for order in other:
+        order['orderId'] += 10 ** 6
+        for activity in order.get('orderActivityCollection', ()):
+            activity['activityId'] += 10 ** 6
+    (tmp_path / 'other.json').write_text(json.dumps(other))
+    pattern = str(tmp_path / '*.json')
+    legs = import_paths(pattern, processes=1)
+    merged = iter_merged_paths(pattern)
+    assert not isinstance(merged, list)
+    assert list(merged) == legs
+    assert get_positions(iter_merged_paths(pattern)) == get_positions(legs)
+    # An order filled at 09:05 and 10:00 lists both fills before another order's 09:31 fill
+    overlapping = [
+        {
+            'orderId': order_id,
+            'orderLegCollection': [{'instruction': instruction, 'instrument': {'symbol': 'Z'}}],
+            'orderActivityCollection': [
+                {'activityId': order_id * 10 + i, 'executionLegs': [{'quantity': 5.0, 'price': 10.0, 'time': time}]}
+                for i, time in enumerate(times)
+            ]
+        }
+        for order_id, instruction, times in [
+            (2000002, 'SELL', ['2023-01-03T09:31:00+0000']),
+            (2000001, 'BUY', ['2023-01-03T09:05:00+0000', '2023-01-03T10:00:00+0000']),
+        ]
+    ]
+    (tmp_path / 'overlapping.json').write_text(json.dumps(overlapping))
+    legs = import_paths(pattern, processes=1)
+    assert [leg['order_id'] for leg in TdaTradeImporter.iter_path(str(tmp_path / 'overlapping.json'))] == \
+        [2000001, 2000001, 2000002]
+    assert list(iter_merged_paths(pattern)) == legs
+    assert get_positions(iter_merged_paths(pattern)) == get_positions(legs)
+
+    # With entry times, legs are only held back until no later order can precede them
+    overlapping[0]['enteredTime'] = '2023-01-03T09:30:00+0000'
+    overlapping[1]['enteredTime'] = '2023-01-03T09:00:00+0000'
+    (tmp_path / 'overlapping.json').write_text(json.dumps(overlapping))
+    sorted_legs = TdaTradeImporter.iter_sorted_path(str(tmp_path / 'overlapping.json'))
+    assert [(leg['order_id'], leg['time'].hour) for leg in sorted_legs] == [(2000001, 9), (2000002, 9), (2000001, 10)]
+    assert list(iter_merged_paths(pattern)) == legs
+    # Listed after an order entered at 09:00, a fill at 08:45 would already have been overtaken
+    overlapping[0]['enteredTime'] = '2023-01-03T08:30:00+0000'
+    overlapping[0]['orderActivityCollection'][0]['executionLegs'][0]['time'] = '2023-01-03T08:45:00+0000'
+    (tmp_path / 'unordered.txt').write_text(json.dumps(overlapping))
+    with pytest.raises(ValueError):
+        list(TdaTradeImporter.iter_sorted_path(str(tmp_path / 'unordered.txt')))
+
+
+def test_seen_keys_spill_to_disk():
+    keys = [(order_id, order_id * 10 + 1, execution_index) for order_id in range(500) for execution_index in range(3)]
+    seen = SeenKeys(max_memory_keys=100)
+    assert all(seen.add(key) for key in keys)
+    assert len(seen) == len(keys)
+    assert not any(seen.add(key) for key in keys[::7])
+    # Fifteen spills in, keys never added still almost never reach the disk
+    assert sum(seen._might_be_spilled((order_id, 0, 0)) for order_id in range(1000, 3000)) < 40
+    seen.close()
+    legs = [{'order_id': 1, 'activity_id': None, 'quantity': 1}, {'order_id': 1, 'quantity': 2},
+            {'order_id': 1, 'activity_id': 2, 'execution_index': 0, 'quantity': 3}]
+    assert [leg['quantity'] for leg in iter_unique_legs(legs * 3, max_memory_keys=2)] == [1, 3]
+
+
+def test_scaled_mode_matches_decimal_path(tmp_path):
+    edge_cases = [
+        {'symbol': 'GE', 'instruction': 'SELL_SHORT', 'quantity': 7, 'price': Decimal('72.01'),
+         'time': datetime.datetime(2022, 9, 20), 'order_id': 1},
+        {'symbol': 'GE', 'instruction': 'BUY_TO_COVER', 'quantity': 7, 'price': Decimal('72.01'),
+         'time': datetime.datetime(2022, 9, 21), 'order_id': 2},
+        {'symbol': 'T', 'instruction': 'BUY', 'quantity': 3, 'price': Decimal('100000'),
+         'time': datetime.datetime(2022, 9, 20), 'order_id': 3},
+        {'symbol': 'T', 'instruction': 'BUY', 'quantity': 1, 'price': Decimal('0.0001'),
+         'time': datetime.datetime(2022, 9, 20), 'order_id': 4},
+        {'symbol': 'T', 'instruction': 'SELL', 'quantity': 4, 'price': Decimal('74999.9999'),
+         'time': datetime.datetime(2022, 9, 22), 'order_id': 5},
+    ]
+    export_path = tmp_path / 'export.json'
+    write_orders(str(export_path), orders=300, symbols=5, seed=7)
+    current_date = datetime.date(2022, 11, 1)
+    for data in [legs, edge_cases, TdaTradeImporter.from_path(str(export_path)).legs]:
+        expected = get_position_summaries(get_positions(data), current_date)
+        positions = get_positions(scale_legs(data), scaled=True)
+        position_summaries = get_position_summaries(positions, current_date, backend='scaled')
+        assert [[str(value) for value in summary.values()] for summary in position_summaries] == [
+            [str(value) for value in summary.values()] for summary in expected]
+    assert import_paths([str(export_path)], scaled=True) == scale_legs(
+        TdaTradeImporter.from_path(str(export_path)).legs)
+    with pytest.raises(ValueError):
+        scale_legs([dict(legs[0], price=Decimal('60.334567'))])
+
+
+def test_numpy_backend_matches_python_backend():
+    pytest.importorskip('numpy')
+    data = [
+        {
+            'symbol': 'GE',
+            'instruction': 'SELL_SHORT',
+            'quantity': 7,
+            'price': Decimal('72.01'),
+            'time': datetime.datetime(2022, 9, 20),
+            'order_id': 1
+        },
+        {
+            'symbol': 'GE',
+            'instruction': 'BUY_TO_COVER',
+            'quantity': 3,
+            'price': Decimal('60.334567'),
+            'time': datetime.datetime(2022, 10, 8),
+            'order_id': 2
+        },
+        {
+            'symbol': 'GE',
+            'instruction': 'BUY_TO_COVER',
+            'quantity': 4,
+            'price': Decimal('72.01'),
+            'time': datetime.datetime(2022, 10, 9),
+            'order_id': 3
+        }
+    ]
+    current_date = datetime.date(2022, 11, 1)
+    for positions in [get_positions(legs), get_positions(data)]:
+        expected = get_position_summaries(positions, current_date)
+        position_summaries = get_position_summaries(positions, current_date, backend='numpy')
+        assert position_summaries == expected
+        assert [str(summary['profit']) for summary in position_summaries] == [
+            str(summary['profit']) for summary in expected]
+
+
+def test_position_columns_rows_are_views():
+    pytest.importorskip('numpy')
+    from tradingbutler.vectorized import PositionColumns
+    positions = get_positions(legs)
+    columns = PositionColumns(positions, datetime.date(2022, 11, 1))
+    assert len(columns) == 3
+    assert columns.profit.tolist() == [902400, 1782000, 0]
+    assert columns[1]['profit_percentage'] == Decimal('36.42')
+    assert columns[-1]['exit_price'] is None
+    assert columns[:2] == get_position_summaries(positions[:2])
+
+
+def test_records_keep_mapping_access():
+    positions = get_positions(legs)
+    position_summaries = get_position_summaries(positions)
+    assert isinstance(positions[0], Position)
+    assert isinstance(position_summaries[0], PositionSummary)
+    assert 'closing' in positions[0]
+    assert 'closing' not in positions[2]
+    assert positions[2].get('closing') is None
+    with pytest.raises(KeyError):
+        positions[2]['closing']
+    assert dict(positions[2]['opening']) == {
+        'symbol': 'AMZN',
+        'instruction': 'BUY',
+        'quantity': 12,
+        'price': Decimal('75.2500'),
+        'time': datetime.datetime(2022, 10, 20),
+        'risk': Decimal('903.0000')
+    }
+    assert position_summaries[1].profit == position_summaries[1]['profit'] == Decimal('178.2000')
+    assert pickle.loads(pickle.dumps(positions)) == positions
+
+
+def test_records_are_smaller_than_dicts():
+    leg = TdaTradeImporter(json.dumps(tda_orders)).legs[0]
+    assert isinstance(leg, Leg)
+    assert sys.getsizeof(leg) < sys.getsizeof(dict(leg)) / 2
+    position_summary = get_position_summaries(get_positions(legs))[0]
+    assert sys.getsizeof(position_summary) < sys.getsizeof(dict(position_summary)) / 2
+
+
+def test_write_output_streams_generators(tmp_path):
+    position_summaries = get_position_summaries(get_positions(legs))
+    output_file = tmp_path / 'output.html'
+    write_output(position_summaries, output_file=str(output_file))
+    expected = env.get_template('template.html').render(position_summaries=position_summaries, keys=[
+        'symbol', 'direction', 'entry_date', 'average_price', 'exit_price', 'exit_date', 'days', 'quantity', 'risk',
+        'profit_percentage', 'profit', 'number_legs'])
+    assert output_file.read_text() == expected
+
+    consumed = []
+
+    def generate():
+        for position_summary in position_summaries:
+            consumed.append(position_summary)
+            yield position_summary
+
+    buffer = io.StringIO()
+    write_output(generate(), output_file=buffer, buffer_size=1)
+    assert buffer.getvalue() == expected
+    assert len(consumed) == 3
+
+
+def test_import_does_not_load_rendering_or_dateutil():
+    code = 'import sys, tradingbutler.summary; print(sorted(m for m in ("jinja2", "dateutil") if m in sys.modules))'
+    output = subprocess.run([sys.executable, '-c', code], check=True, stdout=subprocess.PIPE, universal_newlines=True)
+    assert output.stdout.strip() == '[]'
+
+
+def test_cli(tmp_path, monkeypatch):
+    monkeypatch.setenv('TRADINGBUTLER_TEMPLATE_CACHE', str(tmp_path / 'templates'))
+    get_environment.cache_clear()
+    (tmp_path / 'orders.json').write_text(json.dumps(tda_orders))
+    output_file = tmp_path / 'output.html'
+    try:
+        assert main([str(tmp_path / '*.json'), '-o', str(output_file), '--precompile']) == 0
+    finally:
+        get_environment.cache_clear()
+    assert output_file.read_text().count('<tr>') == 5
+    assert list((tmp_path / 'templates').iterdir())
+    store_output_file = tmp_path / 'store.html'
+    assert main([str(tmp_path / '*.json'), '-o', str(store_output_file), '--store', str(tmp_path / 'trades.db')]) == 0
+    assert store_output_file.read_text() == output_file.read_text()
+    assert main([str(tmp_path / '*.json'), '-o', str(store_output_file), '--scaled']) == 0
+    assert store_output_file.read_text() == output_file.read_text()
+    assert main([str(tmp_path / '*.json'), '-o', str(tmp_path / 'output.jsonl')]) == 0
+    assert len((tmp_path / 'output.jsonl').read_text().splitlines()) == 4
+    with pytest.raises(SystemExit):
+        main([str(tmp_path / 'missing*.json')])
+
+
+def test_synthetic_orders_import_cleanly(tmp_path):
+    orders = generate_orders(orders=500, symbols=5, fills_per_order=(1, 4), shares=(1, 50), seed=3)
+    assert orders == generate_orders(orders=500, symbols=5, fills_per_order=(1, 4), shares=(1, 50), seed=3)
+    assert orders[0]['orderId'] == 500
+    importer = TdaTradeImporter(json.dumps(orders))
+    assert {leg['symbol'] for leg in importer.legs} <= {'SYM0', 'SYM1', 'SYM2', 'SYM3', 'SYM4'}
+    assert all(leg['quantity'] >= 1 for leg in importer.legs)
+    fills = collections.Counter(leg['order_id'] for leg in importer.legs)
+    assert max(fills.values()) <= 4
+    assert {leg['instruction'] for leg in importer.legs} == {'BUY', 'SELL', 'SELL_SHORT', 'BUY_TO_COVER'}
+    positions = get_positions(importer.legs)
+    assert sum(1 for position in positions if 'closing' in position) > 100
+
+    path = tmp_path / 'orders.json'
+    write_orders(str(path), orders=500, symbols=5, fills_per_order=(1, 4), shares=(1, 50), seed=3)
+    assert TdaTradeImporter.from_path(str(path)).legs == importer.legs
+
+
+def test_benchmark_reports_every_stage():
+    result = run_benchmark(orders=200, symbols=3)
+    assert result['orders'] == 200
+    for stats in result['stages'].values():
+        assert stats['seconds'] >= 0
+        assert stats['peak_bytes'] > 0
+    assert find_regressions(result, result, 0.2) == []
+
+
+def test_pipeline_stats():
+    assert get_active_stats() is None
+    output = io.StringIO()
+    with PipelineStats(trace_memory=True, output=output) as stats:
+        importer = TdaTradeImporter(json.dumps(tda_orders))
+        positions = get_positions(importer.legs)
+        get_position_summaries(positions)
+        write_output(get_position_summaries(positions), output_file=io.StringIO())
+    assert get_active_stats() is None
+    assert list(stats.stages) == ['json_decode', 'get_legs', 'get_positions', 'get_position_summaries', 'write_output']
+    assert stats['json_decode'].rows == 3
+    assert stats['get_legs'].rows == 4
+    assert stats['get_positions'].rows == 4
+    assert stats['get_position_summaries'].calls == 2
+    assert stats['get_position_summaries'].rows == 8
+    assert stats['write_output'].rows == 4
+    assert all(stage.peak_bytes > 0 and stage.seconds > 0 for stage in stats.stages.values())
+    lines = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert [line['stage'] for line in lines] == [
+        'json_decode', 'get_legs', 'get_positions', 'get_position_summaries', 'get_position_summaries', 'write_output']
+    assert stats.as_dict()['get_legs']['calls'] == 1
+
+
+def test_get_aggregates(tmp_path):
+    data = legs + [
+        {
+            'symbol': 'AAPL',
+            'instruction': 'BUY',
+            'quantity': 10,
+            'price': Decimal('25.10'),
+            'time': datetime.datetime(2022, 10, 11),
+            'order_id': 6
+        },
+        {
+            'symbol': 'AAPL',
+            'instruction': 'SELL',
+            'quantity': 10,
+            'price': Decimal('24.05'),
+            'time': datetime.datetime(2022, 10, 14),
+            'order_id': 7
+        }
+    ]
+    position_summaries = get_position_summaries(get_positions(data), datetime.date(2022, 11, 1))
+    aggregates = get_aggregates(position_summaries)
+    assert list(aggregates) == ['all', 'symbol', 'direction', 'month', 'day']
+    total = aggregates['all'][0]
+    assert dict(total) == {
+        'grouping': 'all',
+        'key': 'All',
+        'positions': 4,
+        'open': 1,
+        'closed': 3,
+        'wins': 2,
+        'losses': 1,
+        'win_rate': Decimal('66.67'),
+        'total_profit': Decimal('257.9400'),
+        'expectancy': Decimal('85.9800'),
+        'average_win': Decimal('134.2200'),
+        'average_loss': Decimal('-10.5000'),
+        'average_days': Decimal('10.00'),
+        'total_risk': Decimal('2112.7400')
+    }
+    assert [(row['key'], row['positions'], row['closed']) for row in aggregates['symbol']] == [
+        ('AAPL', 2, 2), ('AMZN', 1, 0), ('ATT', 1, 1)]
+    assert aggregates['symbol'][1]['win_rate'] is None
+    assert [(row['key'], row['total_profit']) for row in aggregates['direction']] == [
+        ('Long', Decimal('167.7000')), ('Short', Decimal('90.2400'))]
+    assert [(row['key'], row['closed']) for row in aggregates['month']] == [('2022-09', 1), ('2022-10', 2)]
+    assert [row['key'] for row in aggregates['day']] == [
+        datetime.date(2022, 9, 20), datetime.date(2022, 10, 10), datetime.date(2022, 10, 14)]
+
+    output_file = tmp_path / 'aggregates.html'
+    write_aggregates(get_aggregates(position_summaries, groupings=('symbol',)), output_file=str(output_file))
+    html = output_file.read_text()
+    assert '<h2>symbol</h2>' in html
+    assert html.count('<tr>') == 4
+
+
+def test_position_index_matches_filtering(tmp_path):
+    export_path = tmp_path / 'export.json'
+    write_orders(str(export_path), orders=400, symbols=5, seed=3)
+    positions = get_positions(TdaTradeImporter.from_path(str(export_path)).legs)
+    position_summaries = get_position_summaries(positions, datetime.date(2020, 3, 1))
+    index = PositionIndex(position_summaries)
+    assert len(index) == len(position_summaries)
+    assert index.symbols == ['SYM0', 'SYM1', 'SYM2', 'SYM3', 'SYM4']
+
+    start, end = datetime.date(2020, 1, 5), datetime.date(2020, 1, 9)
+    for symbol in (None, 'SYM2'):
+        for direction in (None, 'Long', 'Short'):
+            for status in (None, 'open', 'closed'):
+                expected = sorted(
+                    (row for row in position_summaries
+                     if symbol in (None, row['symbol']) and direction in (None, row['direction'])
+                     and status in (None, 'open' if row['exit_date'] is None else 'closed')
+                     and start <= row['entry_date'] <= end),
+                    key=lambda row: row['entry_date'])
+                assert index.query(symbol, direction, status, start, end) == expected
+    closed = index.query(status='closed', start=start, end=end, date='exit')
+    assert closed == sorted((row for row in position_summaries
+                             if row['exit_date'] is not None and start <= row['exit_date'] <= end),
+                            key=lambda row: row['exit_date'])
+    assert index.query(status='open', date='exit') == []
+    assert index.query(symbol='MISSING') == []
+
+    position_index = PositionIndex(positions)
+    assert len(position_index.query('SYM1')) == len(index.query('SYM1'))
+    with pytest.raises(ValueError):
+        index.query(direction='long')
+
+
+def test_position_index_adds_between_queries(tmp_path):
+    export_path = tmp_path / 'export.json'
+    write_orders(str(export_path), orders=400, symbols=5, seed=3)
+    positions = get_positions(TdaTradeImporter.from_path(str(export_path)).legs)
+    position_summaries = get_position_summaries(positions, datetime.date(2020, 3, 1))
+    # Summaries out of date order, added one at a time and then in batches large enough to be merged
+    shuffled = sorted(position_summaries, key=lambda row: (row['symbol'], row['exit_date'] or datetime.date.max))
+    index = PositionIndex(shuffled[:100])
+    for row in shuffled[100:120]:
+        index.add_position(row)
+        index.query('SYM1')
+    for offset in range(120, len(shuffled), 50):
+        index.add_positions(shuffled[offset:offset + 50])
+        index.query(start=datetime.date(2020, 1, 5))
+    expected = PositionIndex(shuffled)
+    for symbol in (None, 'SYM1'):
+        for date in ('entry', 'exit'):
+            assert index.query(symbol, date=date) == expected.query(symbol, date=date)
+    assert index.query() == sorted(shuffled, key=lambda row: row['entry_date'])
+
+
+def test_report_watcher_renders_deltas(tmp_path):
+    def get_cells(path):
+        return re.findall(r'<td>\s*(.*?)\s*</td>', path.read_text(), re.S)
+
+    orders = generate_orders(orders=400, symbols=6, seed=8)
+    exports = tmp_path / 'exports'
+    exports.mkdir()
+    (exports / 'a.json').write_text(json.dumps(orders[150:]))
+    output_file = tmp_path / 'output.html'
+    expected_file = tmp_path / 'expected.html'
+    current_date = datetime.date(2020, 3, 1)
+    watcher = ReportWatcher(str(exports), output_file=str(output_file))
+    assert watcher.poll(current_date)
+    assert not watcher.poll(current_date)
+    write_output(get_position_summaries(get_positions(TdaTradeImporter(json.dumps(orders[150:])).legs), current_date),
+                 output_file=str(expected_file))
+    assert get_cells(output_file) == get_cells(expected_file)
+
+    closed_rows = list(watcher._closed_rows)
+    (exports / 'b.json').write_text(json.dumps(orders[:200]))
+    assert watcher.poll(current_date)
+    assert all(row is closed_row for row, closed_row in zip(watcher._closed_rows, closed_rows))
+    write_output(get_position_summaries(get_positions(TdaTradeImporter(json.dumps(orders)).legs), current_date),
+                 output_file=str(expected_file))
+    assert get_cells(output_file) == get_cells(expected_file)
+
+    # A second account interleaves with the first and lands last, forcing a rebuild
+    other_orders = generate_orders(orders=100, symbols=['X', 'Y'], seed=9)
+    for order in other_orders:
+        order['orderId'] += 10000
+        for activity in order.get('orderActivityCollection', []):
+            activity['activityId'] += 10000
+    (exports / 'c.json').write_text(json.dumps(other_orders))
+    assert watcher.poll(current_date)
+    legs = TdaTradeImporter(json.dumps(orders)).legs + TdaTradeImporter(json.dumps(other_orders)).legs
+    legs.sort(key=lambda leg: (leg['time'], leg['order_id'], leg['activity_id']))
+    write_output(get_position_summaries(get_positions(legs), current_date), output_file=str(expected_file))
+    assert get_cells(output_file) == get_cells(expected_file)
+
+
+def test_report_watcher_skips_unmatched_export(tmp_path, caplog):
+    orders = generate_orders(orders=200, symbols=3, seed=10)
+    exports = tmp_path / 'exports'
+    exports.mkdir()
+    (exports / 'a.json').write_text(json.dumps(orders[100:]))
+    watcher = ReportWatcher(str(exports), output_file=str(tmp_path / 'output.html'))
+    assert watcher.poll(datetime.date(2020, 3, 1))
+    positions = list(watcher.book.positions)
+    # A mistyped fill closes more shares than are open
+    broken = json.loads(json.dumps(orders[:150]))
+    closing = next(order for order in broken if order['status'] == 'FILLED'
+                   and order['orderLegCollection'][0]['instruction'] in ('SELL', 'BUY_TO_COVER'))
+    closing['orderActivityCollection'][0]['executionLegs'][0]['quantity'] += 100000
+    (exports / 'b.json').write_text(json.dumps(broken))
+    assert not watcher.poll(datetime.date(2020, 3, 1))
+    assert 'closing more shares than open' in caplog.text
+    assert watcher.book.positions == positions
+    (exports / 'b.json').write_text(json.dumps(orders[:150]))
+    assert watcher.poll(datetime.date(2020, 3, 1))
+    assert watcher.book.positions == get_positions(TdaTradeImporter(json.dumps(orders)).legs)
+
+
+def test_export_csv_and_jsonl(tmp_path):
+    position_summaries = get_position_summaries(get_positions(legs), datetime.date(2022, 11, 1))
+    write_csv((summary for summary in position_summaries), output_file=str(tmp_path / 'output.csv'))
+    with open(tmp_path / 'output.csv', newline='') as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ['symbol', 'direction', 'entry_date', 'average_price', 'exit_price', 'exit_date', 'days',
+                       'quantity', 'risk', 'profit_percentage', 'profit', 'number_legs']
+    assert rows[1:] == [['' if summary[key] is None else str(summary[key]) for key in rows[0]]
+                        for summary in position_summaries]
+
+    keys = ['symbol', 'entry_date', 'exit_price', 'profit', 'order_ids']
+    write_jsonl(iter(position_summaries), output_file=str(tmp_path / 'output.jsonl'), keys=keys)
+    lines = (tmp_path / 'output.jsonl').read_text().splitlines()
+    assert len(lines) == len(position_summaries)
+    for line, summary in zip(lines, position_summaries):
+        row = json.loads(line, parse_float=Decimal)
+        assert list(row) == keys
+        assert row['entry_date'] == summary['entry_date'].isoformat()
+        assert row['order_ids'] == summary['order_ids']
+        assert str(row['profit']) == str(summary['profit'])
+
+    output = io.StringIO()
+    aggregates = get_aggregates(position_summaries, groupings=('all', 'symbol'))
+    write_csv(iter_aggregate_rows(aggregates), output_file=output, keys=EXPORT_KEYS)
+    rows = list(csv.reader(io.StringIO(output.getvalue())))
+    assert [row[:2] for row in rows] == [['grouping', 'key'], ['all', 'All'], ['symbol', 'AAPL'], ['symbol', 'AMZN'],
+                                         ['symbol', 'ATT']]
+
+
+def test_iter_position_summaries_is_lazy():
+    current_date = datetime.date(2022, 11, 1)
+    expected = get_position_summaries(get_positions(legs), current_date)
+    consumed = []
+
+    def iter_positions():
+        for position in get_positions(legs):
+            consumed.append(position)
+            yield position
+
+    position_summaries = iter_position_summaries(iter_positions(), current_date)
+    assert next(position_summaries) == expected[0]
+    assert len(consumed) == 1
+    assert list(position_summaries) == expected[1:]
+
+    views = list(iter_position_summaries(get_positions(legs), current_date, lazy=True))
+    assert views == expected
+    assert [str(view['profit']) for view in views] == [str(summary['profit']) for summary in expected]
+    view = next(iter_position_summaries(get_positions(legs), current_date, lazy=True))
+    assert view['symbol'] == expected[0]['symbol']
+    assert view._closing_values is None
+    assert view['profit_percentage'] == expected[0]['profit_percentage']
+    assert view._closing_values is not None
+    with pytest.raises(KeyError):
+        view['missing']
+    with pytest.raises(ValueError):
+        next(iter_position_summaries([], lazy=True, backend='scaled'))
+
+
+def test_mark_to_market(tmp_path):
+    current_date = datetime.date(2022, 11, 1)
+    snapshot_path = tmp_path / 'marks.json'
+    snapshot_path.write_text('{"AMZN": 80.5, "AAPL": {"price": 150, "time": "2022-10-31T16:00:00-0400"}}')
+    snapshot = PriceSnapshot.from_path(str(snapshot_path))
+    assert snapshot.get_price('AMZN') == Decimal('80.5')
+    assert snapshot.times['AAPL'] == parse('2022-10-31T16:00:00-0400')
+
+    positions = get_positions(legs)
+    expected = get_position_summaries(positions, current_date)
+    position_summaries = list(iter_marked_summaries(positions, snapshot, current_date))
+    assert position_summaries[:-1] == expected[:-1]
+    marked = position_summaries[-1]
+    assert (marked['symbol'], marked['exit_date'], marked['days']) == ('AMZN', None, 12)
+    assert marked['exit_price'] == Decimal('80.5000')
+    assert marked['profit'] == Decimal('63.0000')
+    assert marked['profit_percentage'] == Decimal('6.98')
+    assert get_aggregates(position_summaries)['all'][0] == get_aggregates(expected)['all'][0]
+
+    book = PositionBook()
+    book.add_legs(legs)
+    marker = MarkToMarket()
+    open_summaries = marker.mark(book.get_open_positions(), snapshot, current_date)
+    assert marker.mark(book.get_open_positions(), snapshot, current_date)[0] is open_summaries[0]
+    snapshot_path.write_text('symbol,price\nAMZN,70.25\n')
+    csv_path = tmp_path / 'marks.csv'
+    snapshot_path.rename(csv_path)
+    remarked = marker.mark(book.get_open_positions(), PriceSnapshot.from_path(str(csv_path)), current_date)
+    assert remarked[0]['profit'] == Decimal('-60.0000')
+    assert marker.mark(book.get_open_positions(), PriceSnapshot({}, version='empty'), current_date) == \
+        expected[-1:]
+    in_memory = marker.mark(book.get_open_positions(), PriceSnapshot({'AMZN': Decimal('80.5')}), current_date)
+    assert in_memory[0]['profit'] == Decimal('63.0000')
+    assert marker.mark(book.get_open_positions(), PriceSnapshot({'AMZN': Decimal('80.5')}), current_date)[0] is \
+        in_memory[0]
+    remarked = marker.mark(book.get_open_positions(), PriceSnapshot({'AMZN': Decimal('70.25')}), current_date)
+    assert remarked[0]['profit'] == Decimal('-60.0000')
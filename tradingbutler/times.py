@@ -0,0 +1,65 @@
+import datetime
+import re
+from functools import lru_cache
+
+# Times are encoded as microseconds since the epoch, in UTC when aware, with the UTC offset in seconds beside them
+NAIVE_OFFSET = -2 ** 31
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+NAIVE_EPOCH = datetime.datetime(1970, 1, 1)
+
+_TDA_TIME = re.compile(r'([0-9]{4})-([0-9]{2})-([0-9]{2})T([0-9]{2}):([0-9]{2}):([0-9]{2})([+-][0-9]{4})$')
+
+
+@lru_cache(maxsize=None)
+def get_tzinfo(offset):
+    from dateutil.parser import parse
+
+    # Let dateutil pick the tzinfo once per offset so results stay identical to parse()
+    return parse('2000-01-01T00:00:00' + offset).tzinfo
+
+
+@lru_cache(maxsize=4096)
+def _parse_time_fallback(value):
+    from dateutil.parser import parse
+
+    return parse(value)
+
+
+def parse_time(value):
+    match = _TDA_TIME.match(value)
+    if match:
+        year, month, day, hour, minute, second, offset = match.groups()
+        try:
+            return datetime.datetime(int(year), int(month), int(day), int(hour), int(minute), int(second),
+                                     tzinfo=get_tzinfo(offset))
+        except ValueError:
+            pass
+    return _parse_time_fallback(value)
+
+
+def encode_time(value):
+    offset = value.utcoffset()
+    if offset is None:
+        return (value - NAIVE_EPOCH) // datetime.timedelta(microseconds=1), NAIVE_OFFSET
+    return (value - EPOCH) // datetime.timedelta(microseconds=1), int(offset.total_seconds())
+
+
+@lru_cache(maxsize=None)
+def get_offset_tzinfo(offset):
+    if offset % 60:
+        return datetime.timezone(datetime.timedelta(seconds=offset))
+    # Same tzinfo parse_time hands out for the offset, so decoded times compare and format identically
+    hours, minutes = divmod(abs(offset) // 60, 60)
+    return get_tzinfo('{}{:02}{:02}'.format('-' if offset < 0 else '+', hours, minutes))
+
+
+@lru_cache(maxsize=None)
+def get_local_epoch(offset):
+    # The epoch as wall time at the offset; adding to it keeps the tzinfo, so one addition decodes a time
+    return (EPOCH + datetime.timedelta(seconds=offset)).replace(tzinfo=get_offset_tzinfo(offset))
+
+
+def decode_time(time, offset):
+    if offset == NAIVE_OFFSET:
+        return NAIVE_EPOCH + datetime.timedelta(microseconds=time)
+    return get_local_epoch(offset) + datetime.timedelta(microseconds=time)
@@ -0,0 +1,153 @@
+import datetime
+import operator
+from decimal import Decimal
+
+from tradingbutler.records import PositionSummary
+from tradingbutler.scaled import PERCENTAGE_PLACES
+from tradingbutler.scaled import PLACES
+from tradingbutler.scaled import from_scaled
+from tradingbutler.scaled import is_negative_zero
+from tradingbutler.scaled import round_half_up
+
+SUMMARY_PLACES = PLACES
+# Intermediate products such as 2 * quantity * scaled price must stay inside int64
+MAX_SCALED = 2 ** 60
+
+
+def _import_numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError('the numpy backend requires numpy to be installed') from None
+    return numpy
+
+
+def _get_places(value):
+    exponent = value.as_tuple().exponent
+    return -exponent if exponent < 0 else 0
+
+
+def _to_scaled(values, places):
+    factor = Decimal(10) ** places
+    scaled = [value * factor for value in values]
+    integers = list(map(int, scaled))
+    if any(map(operator.ne, integers, scaled)):
+        return None
+    return integers
+
+
+def _from_scaled(values, places, negative_zero=None):
+    unit = Decimal(1).scaleb(-places)
+    if negative_zero is None:
+        return [from_scaled(value, unit) for value in values]
+    return [from_scaled(value, unit, negative) for value, negative in zip(values, negative_zero)]
+
+
+class PositionColumns:
+    def __init__(self, positions, current_date=None):
+        np = _import_numpy()
+        if current_date is None:
+            current_date = datetime.datetime.now().date()
+        self.positions = positions if isinstance(positions, list) else list(positions)
+        self._rows = None
+        openings = [position['opening'] for position in self.positions]
+        closings = [position.get('closing') for position in self.positions]
+        self.closed = np.array([closing is not None for closing in closings], dtype=bool)
+        self.symbol = [opening['symbol'] for opening in openings]
+        self.long = np.array([opening['instruction'] == 'BUY' for opening in openings], dtype=bool)
+        self.cover = np.array([closing is not None and 'BUY_TO_COVER' in closing['instruction']
+                               for closing in closings], dtype=bool)
+        self.quantity = np.array([opening['quantity'] for opening in openings], dtype=np.int64)
+        self.entry_date = [opening['time'].date() for opening in openings]
+        self.exit_date = [closing['time'].date() if closing is not None else None for closing in closings]
+
+        prices = [opening['price'] for opening in openings]
+        risks = [opening['risk'] for opening in openings]
+        closing_prices = [closing['price'] if closing is not None else Decimal(0) for closing in closings]
+        # One common scale for all inputs keeps every intermediate result an exact integer
+        self.places = SUMMARY_PLACES
+        columns = [_to_scaled(values, self.places) for values in (prices, risks, closing_prices)]
+        if None in columns:
+            self.places = max([SUMMARY_PLACES] + [_get_places(value) for value in prices + risks + closing_prices])
+            columns = [_to_scaled(values, self.places) for values in (prices, risks, closing_prices)]
+        price, risk, closing_price = [np.array(column, dtype=np.int64) for column in columns]
+        if len(self.positions) and max(
+                int(np.abs(closing_price).max()) * max(int(self.quantity.max()), 10 ** (SUMMARY_PLACES + 1)),
+                int(np.abs(price).max()) * 10 ** (SUMMARY_PLACES + 1),
+                int(np.abs(risk).max())) >= MAX_SCALED:
+            raise OverflowError('values too large for the numpy backend')
+
+        rescale = 10 ** (self.places - SUMMARY_PLACES)
+        size = self.quantity * closing_price
+        profit = size - risk
+        change = closing_price - price
+        self.exit_price = np.where(self.closed, round_half_up(closing_price, rescale), 0)
+        self.profit = np.where(self.closed, round_half_up(profit, rescale), 0)
+        self.profit_percentage = np.where(
+            self.closed, round_half_up(10 ** (PERCENTAGE_PLACES + 2) * change, np.where(self.closed, price, 1)), 0)
+        self.profit = np.where(self.cover, -self.profit, self.profit)
+        self.profit_percentage = np.where(self.cover, -self.profit_percentage, self.profit_percentage)
+        self.negative_zero_profit = self.closed & is_negative_zero(self.profit, profit, self.cover)
+        self.negative_zero_profit_percentage = self.closed & is_negative_zero(self.profit_percentage, change,
+                                                                              self.cover)
+
+        entry_ordinal = np.array([date.toordinal() for date in self.entry_date], dtype=np.int64)
+        exit_ordinal = np.array([date.toordinal() if date is not None else current_date.toordinal()
+                                 for date in self.exit_date], dtype=np.int64)
+        self.days = exit_ordinal - entry_ordinal
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.get_summary(index)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.get_summary(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('position index out of range')
+        return self.get_summary(index)
+
+    def _get_rows(self):
+        if self._rows is None:
+            self._rows = (
+                self.closed.tolist(),
+                self.long.tolist(),
+                self.quantity.tolist(),
+                _from_scaled(self.exit_price.tolist(), SUMMARY_PLACES),
+                _from_scaled(self.profit.tolist(), SUMMARY_PLACES, self.negative_zero_profit.tolist()),
+                _from_scaled(self.profit_percentage.tolist(), PERCENTAGE_PLACES,
+                             self.negative_zero_profit_percentage.tolist()),
+                self.days.tolist()
+            )
+        return self._rows
+
+    def get_summary(self, index):
+        closed, long, quantity, exit_price, profit, profit_percentage, days = self._get_rows()
+        position = self.positions[index]
+        opening = position['opening']
+        order_ids = position['order_ids']
+        is_closed = closed[index]
+        return PositionSummary(
+            symbol=self.symbol[index],
+            risk=opening['risk'],
+            entry_date=self.entry_date[index],
+            average_price=opening['price'],
+            exit_price=exit_price[index] if is_closed else None,
+            exit_date=self.exit_date[index],
+            days=days[index],
+            quantity=quantity[index],
+            direction='Long' if long[index] else 'Short',
+            profit=profit[index] if is_closed else None,
+            profit_percentage=profit_percentage[index] if is_closed else None,
+            number_legs=len(set(order_ids)),
+            order_ids=order_ids,
+            activity_ids=position['activity_ids']
+        )
+
+    def to_summaries(self):
+        return list(self)
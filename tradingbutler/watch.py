@@ -0,0 +1,132 @@
+import glob
+import logging
+import os
+import time
+
+from tradingbutler.dedup import SeenKeys
+from tradingbutler.dedup import get_leg_key
+from tradingbutler.summary import DEFAULT_KEYS
+from tradingbutler.summary import PositionBook
+from tradingbutler.summary import TdaTradeImporter
+from tradingbutler.summary import get_environment
+from tradingbutler.summary import get_leg_sort_key
+from tradingbutler.summary import render_template
+
+logger = logging.getLogger(__name__)
+
+
+class ReportWatcher:
+    def __init__(self, directory, output_file='output.html', pattern='*.json', importer_class=TdaTradeImporter,
+                 descending=False, cache_dir=None, keys=None, template_file='template.html', relief='fifo'):
+        self.directory = directory
+        self.output_file = output_file
+        self.pattern = pattern
+        self.importer_class = importer_class
+        self.descending = descending
+        self.cache_dir = cache_dir
+        self.keys = DEFAULT_KEYS if keys is None else keys
+        self.template_file = template_file
+        self.relief = relief
+        self.legs = []
+        self.book = PositionBook(relief=relief)
+        self._seen = SeenKeys()
+        self._signatures = {}
+        self._closed_rows = []
+        self._open_rows = {}
+        self._last_key = None
+
+    def get_changed_paths(self):
+        changed = []
+        for path in sorted(glob.glob(os.path.join(self.directory, self.pattern))):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            signature = stat.st_size, stat.st_mtime_ns
+            if self._signatures.get(path) != signature:
+                self._signatures[path] = signature
+                changed.append(path)
+        return changed
+
+    def ingest(self, paths):
+        count = 0
+        for path in paths:
+            try:
+                legs = self.importer_class.from_path(path, descending=self.descending, cache_dir=self.cache_dir).legs
+            except ValueError:
+                # Most likely still being written, the next poll tries again
+                del self._signatures[path]
+                continue
+            new_legs = {}
+            for leg in legs:
+                key = get_leg_key(leg)
+                if key not in new_legs and key not in self._seen:
+                    new_legs[key] = leg
+            if not new_legs:
+                continue
+            try:
+                self._add_legs(list(new_legs.values()))
+            except ValueError as e:
+                # Its executions are not marked seen, so the export is matched again once it is corrected
+                logger.warning('skipping %s: %s', path, e)
+                continue
+            for key in new_legs:
+                self._seen.add(key)
+            count += len(new_legs)
+        return count
+
+    def _add_legs(self, new_legs):
+        new_legs.sort(key=get_leg_sort_key)
+        if self._last_key is not None and get_leg_sort_key(new_legs[0]) < self._last_key:
+            # A backfilled export reaches behind what was already matched, only a rebuild keeps relief order
+            legs = sorted(self.legs + new_legs, key=get_leg_sort_key)
+            book = PositionBook(relief=self.relief)
+            book.add_legs(legs)
+            self.legs = legs
+            self.book = book
+            self._closed_rows = []
+        else:
+            try:
+                self.book.add_legs(new_legs)
+            except ValueError:
+                # Undo the legs matched before the failing one; the closed positions come out the same, so the rendered
+                # closed rows stay valid
+                self.book = PositionBook(relief=self.relief)
+                self.book.add_legs(self.legs)
+                raise
+            self.legs.extend(new_legs)
+        self._last_key = get_leg_sort_key(self.legs[-1])
+
+    def get_rows(self, current_date=None):
+        render_row = get_environment().get_template('row.html').module.render_row
+        position_summaries = self.book.get_position_summaries(current_date)
+        closed = len(self.book.closed_positions)
+        # Closed rows never change once rendered; open rows are reused while their summary stays the same
+        for position_summary in position_summaries[len(self._closed_rows):closed]:
+            self._closed_rows.append(render_row(position_summary, self.keys))
+        open_rows = {}
+        for position_summary in position_summaries[closed:]:
+            values = (position_summary['symbol'],) + tuple(position_summary[key] for key in self.keys)
+            row = self._open_rows.get(values)
+            if row is None:
+                row = render_row(position_summary, self.keys)
+            open_rows[values] = row
+        self._open_rows = open_rows
+        return self._closed_rows + list(open_rows.values())
+
+    def poll(self, current_date=None):
+        changed = self.get_changed_paths()
+        if not changed:
+            return False
+        if not self.ingest(changed) and os.path.exists(self.output_file):
+            return False
+        render_template(self.template_file, self.output_file, keys=self.keys, rows=self.get_rows(current_date))
+        return True
+
+    def run(self, interval=1.0, iterations=None):
+        count = 0
+        while iterations is None or count < iterations:
+            if count:
+                time.sleep(interval)
+            self.poll()
+            count += 1